@@ -0,0 +1,72 @@
+"""Общий кэш страниц ленты рецептов для анонимных пользователей.
+
+Ключ страницы включает хост и схему запроса (в ответе абсолютные ссылки),
+параметры запроса, версию состава ленты и версию справочников. Вместе со
+страницей хранится время последнего изменения каждого ее рецепта и
+автора: правка рецепта или профиля автора делает недействительными
+только страницы, на которых они есть. Страница не кэшируется, если
+что-то из нее изменилось после начала ее построения.
+"""
+import hashlib
+
+from django.core.cache import cache
+from foodgram.settings import FEED_CACHE_TIMEOUT
+from recipes import versions
+
+HITS_KEY = 'api:feed-cache:hits'
+MISSES_KEY = 'api:feed-cache:misses'
+
+
+def make_key(request):
+    params = sorted(
+        (name, sorted(value for value in values if value))
+        for name, values in request.query_params.lists()
+    )
+    params = [(name, values) for name, values in params if values]
+    keys = (versions.FEED, versions.CATALOG)
+    if 'search' in request.query_params:
+        # Выдача поиска зависит от текста любого рецепта.
+        keys += (versions.RECIPES, )
+    raw = repr((request.scheme, request.get_host(),
+                versions.get_versions(*keys), params))
+    return 'api:feed-cache:page:' + hashlib.md5(raw.encode()).hexdigest()
+
+
+def touched_keys(data):
+    results = data['results'] if isinstance(data, dict) else data
+    keys = set()
+    for recipe in results:
+        keys.add(versions.recipe_key(recipe['id']))
+        keys.add(versions.author_key(recipe['author']['id']))
+    return sorted(keys)
+
+
+def count(key):
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        pass
+
+
+def get_page(key):
+    entry = cache.get(key)
+    if entry is not None and versions.get_touched(
+            *entry['touched']) != entry['touched']:
+        entry = None
+    count(MISSES_KEY if entry is None else HITS_KEY)
+    return None if entry is None else entry['data']
+
+
+def set_page(key, data, started):
+    """Сохраняет страницу, построенную по данным, прочитанным после started."""
+    touched = versions.get_touched(*touched_keys(data))
+    if all(value < started for value in touched.values()):
+        cache.set(key, {'data': data, 'touched': touched},
+                  FEED_CACHE_TIMEOUT)
+
+
+def get_stats():
+    stats = cache.get_many((HITS_KEY, MISSES_KEY))
+    return {'hits': stats.get(HITS_KEY, 0),
+            'misses': stats.get(MISSES_KEY, 0)}
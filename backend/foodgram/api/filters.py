@@ -1,14 +1,29 @@
+from django.db.models import Exists, OuterRef
 from django_filters.rest_framework import FilterSet, filters
-from recipes.models import Ingredient, Recipe
+from recipes.catalog import get_catalog
+from recipes.models import Recipe, TagRecipe
 from users.models import User
 
 
+def tag_choices():
+    return [(tag.slug, tag.slug) for tag in get_catalog().tags]
+
+
 class RecipeFilter(FilterSet):
     author = filters.ModelChoiceFilter(queryset=User.objects.all())
-    tags = filters.AllValuesMultipleFilter(field_name='tags__slug')
+    tags = filters.MultipleChoiceFilter(
+        choices=tag_choices, method='get_tags')
     is_favorited = filters.BooleanFilter(method='get_is_favorited')
     is_in_shopping_cart = filters.BooleanFilter(
         method='get_is_in_shopping_cart')
+    search = filters.CharFilter(method='get_search')
+
+    def get_tags(self, queryset, name, value):
+        if not value:
+            return queryset
+        tag_ids = [tag.id for tag in get_catalog().tags if tag.slug in value]
+        return queryset.filter(Exists(TagRecipe.objects.filter(
+            recipe=OuterRef('pk'), tag_id__in=tag_ids)))
 
     def get_is_favorited(self, queryset, name, value):
         if self.request.user.is_authenticated and value:
@@ -22,14 +37,12 @@ class RecipeFilter(FilterSet):
             return queryset.filter(is_in_shopping_list__user=self.request.user)
         return queryset
 
+    def get_search(self, queryset, name, value):
+        value = value.strip()
+        if not value:
+            return queryset
+        return queryset.search(value)
+
     class Meta:
         model = Recipe
         fields = ('author', 'tags')
-
-
-class IngredientFilter(FilterSet):
-    name = filters.CharFilter(lookup_expr='startswith')
-
-    class Meta:
-        model = Ingredient
-        fields = ('name', )
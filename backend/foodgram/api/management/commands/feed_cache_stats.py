@@ -0,0 +1,15 @@
+from api import feed_cache
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Показывает счетчики попаданий в кэш ленты рецептов.'
+
+    def handle(self, *args, **options):
+        stats = feed_cache.get_stats()
+        total = stats['hits'] + stats['misses']
+        ratio = stats['hits'] / total * 100 if total else 0
+        self.stdout.write(
+            f'Попаданий: {stats["hits"]}, промахов: {stats["misses"]}, '
+            f'доля попаданий: {ratio:.1f}%'
+        )
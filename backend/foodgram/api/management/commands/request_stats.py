@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from foodgram import instrumentation
+
+
+def percentile(stats, percent):
+    """Верхняя граница корзины гистограммы, в которую попал перцентиль."""
+    threshold = stats['count'] * percent / 100
+    seen = 0
+    for limit in instrumentation.BUCKETS_MS:
+        seen += stats[f'le_{limit}']
+        if seen >= threshold:
+            return f'≤{limit}'
+    return f'>{instrumentation.BUCKETS_MS[-1]}'
+
+
+class Command(BaseCommand):
+    help = ('Показывает время ответа, время и число SQL-запросов '
+            'по маршрутам API, накопленные InstrumentationMiddleware.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reset',
+            action='store_true',
+            help='Обнулить накопленные счетчики'
+        )
+
+    def handle(self, *args, **options):
+        if options['reset']:
+            instrumentation.reset_stats()
+            self.stdout.write(self.style.SUCCESS('Счетчики обнулены'))
+            return
+        stats = instrumentation.get_stats()
+        if not stats:
+            self.stdout.write('Данных пока нет')
+            return
+        for route, route_stats in sorted(
+            stats.items(), key=lambda item: -item[1]['total_us']
+        ):
+            count = route_stats['count']
+            if not count:
+                continue
+            self.stdout.write(
+                f'{route:<48} запросов {count:>7}  '
+                f'среднее {route_stats["total_us"] / count / 1000:>8.1f} мс  '
+                f'p50 {percentile(route_stats, 50):>6} мс  '
+                f'p95 {percentile(route_stats, 95):>6} мс  '
+                f'SQL {route_stats["queries"] / count:>5.1f} шт. '
+                f'{route_stats["db_us"] / count / 1000:>7.1f} мс'
+            )
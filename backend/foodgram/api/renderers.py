@@ -0,0 +1,80 @@
+import csv
+import json
+
+from rest_framework import renderers
+
+
+class Echo:
+    """Файлоподобный объект, возвращающий записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+class ShoppingCartRenderer(renderers.BaseRenderer):
+    """Базовый рендерер списка покупок.
+
+    Список отдается потоком через stream(), render() используется
+    только для ответов с ошибками.
+    """
+
+    charset = 'utf-8'
+    extension = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return json.dumps(data, ensure_ascii=False).encode(self.charset)
+
+    def stream(self, rows):
+        raise NotImplementedError('stream() must be implemented.')
+
+
+class ShoppingCartTextRenderer(ShoppingCartRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+    extension = 'txt'
+
+    def stream(self, rows):
+        yield 'Список ингредиентов для покупки:\r\n'
+        yield 'Ингредиент | количество  | ед.изм'
+        for name, measurement_unit, amount in rows:
+            yield f'\r\n{name} | {amount} | {measurement_unit}'
+
+
+class ShoppingCartCSVRenderer(ShoppingCartRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+    extension = 'csv'
+
+    def stream(self, rows):
+        writer = csv.writer(Echo())
+        yield writer.writerow(('Ингредиент', 'Количество', 'Ед.изм'))
+        for name, measurement_unit, amount in rows:
+            yield writer.writerow((name, amount, measurement_unit))
+
+
+class ShoppingCartJSONRenderer(ShoppingCartRenderer):
+    media_type = 'application/json'
+    format = 'json'
+    extension = 'json'
+
+    def stream(self, rows):
+        yield '['
+        separator = ''
+        for name, measurement_unit, amount in rows:
+            yield separator + json.dumps(
+                {'name': name,
+                 'measurement_unit': measurement_unit,
+                 'amount': amount},
+                ensure_ascii=False
+            )
+            separator = ', '
+        yield ']'
+
+
+SHOPPING_CART_RENDERERS = (
+    ShoppingCartTextRenderer,
+    ShoppingCartCSVRenderer,
+    ShoppingCartJSONRenderer,
+)
@@ -1,12 +1,12 @@
-import base64
-
-from django.core.files.base import ContentFile
 from django.db import transaction
 from djoser.serializers import UserCreateSerializer
-from foodgram.settings import MIN_AMOUNT, MIN_COOKING_TIME
-from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
-                            ShoppingList, Tag, TagRecipe)
-from rest_framework import serializers, status
+from foodgram.settings import (BULK_LINKS_LIMIT, MATCHING_INGREDIENTS_LIMIT,
+                               MIN_AMOUNT, MIN_COOKING_TIME)
+from recipes import images, versions
+from recipes.catalog import get_catalog
+from recipes.models import (Ingredient, IngredientRecipe, Recipe,
+                            ShoppingCartItem, Tag, TagRecipe)
+from rest_framework import serializers
 from rest_framework.validators import UniqueValidator
 from users.models import Subscription, User
 
@@ -22,6 +22,9 @@ class UserSerializer(serializers.ModelSerializer):
                   'first_name', 'last_name', 'is_subscribed')
 
     def get_is_subscribed(self, obj):
+        subscribed = getattr(obj, 'subscribed', None)
+        if subscribed is not None:
+            return subscribed
         user = self.context['request'].user
         if user.is_authenticated:
             return user.subscriber.filter(author=obj).exists()
@@ -72,13 +75,76 @@ class IngredientSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'measurement_unit')
 
 
+class CatalogIngredientField(serializers.Field):
+    """Поле ингредиента, проверяемое по справочнику в памяти."""
+
+    default_error_messages = {
+        'does_not_exist': 'Ингредиента с id={pk_value} не существует.',
+        'incorrect_type': 'Некорректный тип id ингредиента.',
+    }
+
+    def to_internal_value(self, data):
+        try:
+            pk = int(data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type')
+        ingredient = get_catalog().ingredients_by_id.get(pk)
+        if ingredient is None:
+            self.fail('does_not_exist', pk_value=pk)
+        return ingredient
+
+    def to_representation(self, value):
+        return value.pk
+
+
+class BulkPrimaryKeyRelatedField(serializers.ListField):
+    """Список id объектов, которые проверяются одним запросом."""
+
+    child = serializers.IntegerField()
+    default_error_messages = {
+        'does_not_exist': 'Объектов с id={pk_values} не существует.',
+    }
+
+    def __init__(self, queryset, **kwargs):
+        self.queryset = queryset
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        pks = super().to_internal_value(data)
+        objects = self.queryset.in_bulk(set(pks))
+        missing = sorted({pk for pk in pks if pk not in objects})
+        if missing:
+            self.fail('does_not_exist',
+                      pk_values=', '.join(map(str, missing)))
+        return [objects[pk] for pk in pks]
+
+    def to_representation(self, value):
+        return [obj.pk for obj in value.all()]
+
+
+class IngredientRecipeListSerializer(serializers.ListSerializer):
+    """Проверяет все id ингредиентов рецепта за один проход."""
+
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            ingredients_by_id = get_catalog().ingredients_by_id
+            missing = set()
+            for item in data:
+                pk = item.get('id') if isinstance(item, dict) else None
+                if isinstance(pk, int) and pk not in ingredients_by_id:
+                    missing.add(pk)
+            if missing:
+                raise serializers.ValidationError(
+                    'Ингредиентов с id={} не существует.'.format(
+                        ', '.join(map(str, sorted(missing))))
+                )
+        return super().to_internal_value(data)
+
+
 class IngredientRecipeSerializer(serializers.ModelSerializer):
     """Сериализатор для работы с M2M моделью IngredientRecipe."""
 
-    id = serializers.PrimaryKeyRelatedField(
-        source='ingredient',
-        queryset=Ingredient.objects.all()
-    )
+    id = CatalogIngredientField(source='ingredient')
     name = serializers.StringRelatedField(
         source='ingredient.name',
         read_only=True
@@ -91,6 +157,34 @@ class IngredientRecipeSerializer(serializers.ModelSerializer):
     class Meta:
         model = IngredientRecipe
         fields = ('id', 'name', 'measurement_unit', 'amount')
+        list_serializer_class = IngredientRecipeListSerializer
+
+
+class RenditionImageField(serializers.Field):
+    """Адрес уменьшенной копии изображения рецепта.
+
+    В списке рецептов отдается list_rendition, если она указана.
+    """
+
+    def __init__(self, rendition, list_rendition=None, **kwargs):
+        self.rendition = rendition
+        self.list_rendition = list_rendition or rendition
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        rendition = self.rendition
+        if isinstance(self.parent.parent, serializers.ListSerializer):
+            rendition = self.list_rendition
+        return build_url(self.context.get('request'), images.rendition_url(
+            recipe.image, rendition, recipe.renditions_ready))
+
+
+def build_url(request, url):
+    if url and request is not None:
+        return request.build_absolute_uri(url)
+    return url
 
 
 class RecipeGetSerializer(serializers.ModelSerializer):
@@ -101,38 +195,84 @@ class RecipeGetSerializer(serializers.ModelSerializer):
         method_name='get_is_favorited')
     is_in_shopping_cart = serializers.SerializerMethodField(
         method_name='get_is_in_shopping_cart')
+    image = RenditionImageField('full', list_rendition='medium')
+    images = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
         fields = ('id', 'tags', 'author',
                   'ingredients', 'is_favorited', 'is_in_shopping_cart',
-                  'name', 'image', 'text', 'cooking_time')
+                  'name', 'image', 'images', 'text', 'cooking_time')
+
+    def to_representation(self, instance):
+        author_is_subscribed = getattr(instance, 'author_is_subscribed', None)
+        if author_is_subscribed is not None:
+            instance.author.subscribed = author_is_subscribed
+        return super().to_representation(instance)
+
+    def get_images(self, obj):
+        request = self.context.get('request')
+        return {
+            rendition: build_url(request, images.rendition_url(
+                obj.image, rendition, obj.renditions_ready))
+            for rendition in images.RENDITIONS
+        }
 
     def get_is_favorited(self, obj):
+        favorited = getattr(obj, 'favorited', None)
+        if favorited is not None:
+            return favorited
         user = self.context['request'].user
         if user.is_authenticated:
             return user.favorite.filter(recipe=obj).exists()
         return False
 
     def get_is_in_shopping_cart(self, obj):
+        in_shopping_cart = getattr(obj, 'in_shopping_cart', None)
+        if in_shopping_cart is not None:
+            return in_shopping_cart
         user = self.context['request'].user
         if user.is_authenticated:
             return user.shopping_list.filter(recipe=obj).exists()
         return False
 
 
+class RecipeMatchSerializer(RecipeGetSerializer):
+    coverage = serializers.FloatField(read_only=True)
+
+    class Meta(RecipeGetSerializer.Meta):
+        fields = RecipeGetSerializer.Meta.fields + ('coverage', )
+
+
+class IngredientMatchSerializer(serializers.Serializer):
+    """Параметры подбора рецептов по имеющимся ингредиентам."""
+
+    ingredients = serializers.ListField(
+        child=CatalogIngredientField(),
+        min_length=1,
+        max_length=MATCHING_INGREDIENTS_LIMIT)
+    min_coverage = serializers.FloatField(
+        min_value=0, max_value=1, default=0)
+
+
 class Base64ImageField(serializers.ImageField):
     def to_internal_value(self, data):
-        if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
+        try:
+            if isinstance(data, str) and data.startswith('data:image'):
+                header, _, encoded = data.partition(';base64,')
+                content_type = header[len('data:'):]
+                data = images.decode_base64(
+                    encoded, 'temp.' + content_type.split('/')[-1],
+                    content_type)
+            if hasattr(data, 'seek'):
+                images.check_dimensions(data)
+        except ValueError as error:
+            raise serializers.ValidationError(str(error))
         return super().to_internal_value(data)
 
 
 class RecipePostPatchSerializer(serializers.ModelSerializer):
-    tags = serializers.PrimaryKeyRelatedField(
-        many=True, queryset=Tag.objects.all())
+    tags = BulkPrimaryKeyRelatedField(queryset=Tag.objects.all())
     ingredients = IngredientRecipeSerializer(
         many=True,
         source='ingredient_recipe')
@@ -147,18 +287,22 @@ class RecipePostPatchSerializer(serializers.ModelSerializer):
                   'name', 'image', 'text', 'cooking_time')
 
     def to_representation(self, instance):
+        request = self.context.get('request')
+        instance = Recipe.objects.for_feed(request.user).get(pk=instance.pk)
         serializer = RecipeGetSerializer(
-            instance, context={'request': self.context.get('request')}
+            instance, context={'request': request}
         )
         return serializer.data
 
     def validate(self, data):
         ingredients = data['ingredient_recipe']
+        seen = set()
         for ingredient in ingredients:
-            if ingredients.count(ingredient) > 1:
+            if ingredient['ingredient'].id in seen:
                 raise serializers.ValidationError(
                     'Введите одинаковые игредиенты в одной строке'
                 )
+            seen.add(ingredient['ingredient'].id)
             if ingredient['amount'] < MIN_AMOUNT:
                 raise serializers.ValidationError(
                     f'Укажите верно количество {ingredient["ingredient"]}'
@@ -169,79 +313,116 @@ class RecipePostPatchSerializer(serializers.ModelSerializer):
             )
         return data
 
+    @staticmethod
+    def set_tags(recipe, tags):
+        current = set(
+            TagRecipe.objects.filter(recipe=recipe).values_list(
+                'tag_id', flat=True)
+        )
+        new = {tag.id for tag in tags}
+        if current - new:
+            TagRecipe.objects.filter(
+                recipe=recipe, tag_id__in=current - new
+            ).delete()
+        if new - current:
+            TagRecipe.objects.bulk_create(
+                TagRecipe(recipe=recipe, tag_id=tag_id)
+                for tag_id in new - current
+            )
+            versions.bump_on_commit(versions.FEED)
+
+    @staticmethod
+    def set_ingredients(recipe, ingredients):
+        current = {
+            item.ingredient_id: item
+            for item in IngredientRecipe.objects.filter(recipe=recipe)
+        }
+        new = {
+            item['ingredient'].id: item['amount'] for item in ingredients
+        }
+        deltas = {
+            ingredient_id: new.get(ingredient_id, 0) - item.amount
+            for ingredient_id, item in current.items()
+        }
+        removed = current.keys() - new.keys()
+        if removed:
+            IngredientRecipe.objects.filter(
+                recipe=recipe, ingredient_id__in=removed
+            ).bulk_remove()
+        changed = []
+        for ingredient_id, item in current.items():
+            amount = new.get(ingredient_id)
+            if amount is not None and item.amount != amount:
+                item.amount = amount
+                changed.append(item)
+        if changed:
+            IngredientRecipe.objects.bulk_update(changed, ('amount', ))
+        IngredientRecipe.objects.bulk_create(
+            IngredientRecipe(
+                recipe=recipe, ingredient_id=ingredient_id, amount=amount
+            )
+            for ingredient_id, amount in new.items()
+            if ingredient_id not in current
+        )
+        for ingredient_id, amount in new.items():
+            if ingredient_id not in current:
+                deltas[ingredient_id] = amount
+        return deltas
+
     @transaction.atomic
     def create(self, validated_data):
         ingredients = validated_data.pop('ingredient_recipe')
         tags = validated_data.pop('tags')
         new_recipe = Recipe.objects.create(**validated_data)
-
-        for tag in tags:
-            TagRecipe.objects.create(
-                recipe=new_recipe, tag=tag
-            )
-        for ingredient in ingredients:
-            IngredientRecipe.objects.create(
-                ingredient=ingredient['ingredient'], recipe=new_recipe,
+        validated_data['image'].close()
+        images.schedule(new_recipe.id, new_recipe.image.name)
+        TagRecipe.objects.bulk_create(
+            TagRecipe(recipe=new_recipe, tag=tag) for tag in tags
+        )
+        IngredientRecipe.objects.bulk_create(
+            IngredientRecipe(
+                ingredient_id=ingredient['ingredient'].id, recipe=new_recipe,
                 amount=ingredient['amount']
             )
+            for ingredient in ingredients
+        )
         return new_recipe
 
     @transaction.atomic
     def update(self, instance, validated_data):
         ingredients = validated_data.pop('ingredient_recipe')
         tags = validated_data.pop('tags')
+        image_name = instance.image.name
         super().update(instance, validated_data)
-        TagRecipe.objects.filter(recipe=instance).delete()
-        IngredientRecipe.objects.filter(recipe=instance).delete()
-        for tag in tags:
-            TagRecipe.objects.create(
-                recipe=instance, tag=tag
-            )
-        for ingredient in ingredients:
-            IngredientRecipe.objects.create(
-                ingredient=ingredient['ingredient'], recipe=instance,
-                amount=ingredient['amount']
-            )
+        if 'image' in validated_data:
+            validated_data['image'].close()
+        if instance.image.name != image_name:
+            Recipe.objects.filter(pk=instance.pk).update(
+                renditions_ready=False)
+            images.schedule(instance.id, instance.image.name)
+        self.set_tags(instance, tags)
+        ShoppingCartItem.objects.change_recipe(
+            instance.id, self.set_ingredients(instance, ingredients)
+        )
         return instance
 
 
 class RecipeShortSerializer(serializers.ModelSerializer):
     """Сериализатор с сокращенными полями для связных моделей."""
 
+    image = RenditionImageField('thumbnail')
+
     class Meta:
         model = Recipe
         fields = ('id', 'name', 'image', 'cooking_time')
         read_only_fields = ('name', 'cooking_time')
 
-    def validate(self, data):
-        recipe = self.instance
-        user = self.context.get('user')
-        if self.context.get('model') == 'favorite':
-            if Favorite.objects.filter(
-                recipe=recipe, user=user
-            ).exists():
-                raise serializers.ValidationError(
-                    detail='Этот рецепт уже есть в избранном!',
-                    code=status.HTTP_400_BAD_REQUEST
-                )
-        if self.context.get('model') == 'shopping_cart':
-            if ShoppingList.objects.filter(
-                recipe=recipe, user=user
-            ).exists():
-                raise serializers.ValidationError(
-                    detail='Этот рецепт уже есть в списке покупок!',
-                    code=status.HTTP_400_BAD_REQUEST
-                )
-        return data
-
 
 class SubscribeSerializer(serializers.ModelSerializer):
     """Сериализатор для возвращения данных автора после подписки."""
 
     is_subscribed = serializers.SerializerMethodField(
         method_name='get_is_subscribed')
-    recipes_count = serializers.SerializerMethodField(
-        method_name='get_recipes_count')
     recipes = serializers.SerializerMethodField()
 
     class Meta:
@@ -252,36 +433,45 @@ class SubscribeSerializer(serializers.ModelSerializer):
         read_only_fields = ('email', 'username', 'first_name', 'last_name')
 
     def get_is_subscribed(self, obj):
+        subscribed = getattr(obj, 'subscribed', None)
+        if subscribed is not None:
+            return subscribed
         user = self.context.get('user')
         if user.is_authenticated:
             return Subscription.objects.filter(
                 subscriber=user, author=obj).exists()
         return False
 
-    def get_recipes_count(self, obj):
-        return obj.recipes.all().count()
-
     def get_recipes(self, obj):
-        recipes_limit = self.context.get('recipes_limit')
-        queryset = obj.recipes.all()
-        if recipes_limit:
-            queryset = queryset[:int(recipes_limit)]
+        if hasattr(obj, 'latest_recipes'):
+            queryset = obj.latest_recipes
+        else:
+            recipes_limit = self.context.get('recipes_limit')
+            queryset = obj.recipes.all()
+            if recipes_limit is not None:
+                queryset = queryset[:recipes_limit]
         serializer = RecipeShortSerializer(queryset, many=True)
         return serializer.data
 
+
+class BulkLinkSerializer(serializers.Serializer):
+    """Списки id для пакетного добавления и удаления связей."""
+
+    add = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        max_length=BULK_LINKS_LIMIT,
+        default=list)
+    remove = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        max_length=BULK_LINKS_LIMIT,
+        default=list)
+
     def validate(self, data):
-        author = self.instance
-        subscriber = self.context.get('user')
-        if Subscription.objects.filter(
-            subscriber=subscriber, author=author
-        ).exists():
+        add = list(dict.fromkeys(data['add']))
+        remove = list(dict.fromkeys(data['remove']))
+        both = set(add).intersection(remove)
+        if both:
             raise serializers.ValidationError(
-                detail='Вы уже пописаны на этого автора',
-                code=status.HTTP_400_BAD_REQUEST
-            )
-        if author == subscriber:
-            raise serializers.ValidationError(
-                detail='Нельзя подписаться на самого себя',
-                code=status.HTTP_400_BAD_REQUEST
-            )
-        return data
+                f'Id одновременно в add и remove: '
+                f'{", ".join(map(str, sorted(both)))}')
+        return {'add': add, 'remove': remove}
@@ -0,0 +1,75 @@
+from django.core.cache import cache
+from django.test import override_settings
+from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
+                            ShoppingList, Tag, TagRecipe)
+from rest_framework.test import APITestCase
+from users.models import Subscription, User
+
+LOCMEM_CACHES = {
+    alias: {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': f'tests-{alias}',
+    }
+    for alias in ('default', 'versions')
+}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class RecipeFeedQueriesTest(APITestCase):
+    """Число запросов ленты рецептов не зависит от размера страницы."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pass')
+        authors = [
+            User.objects.create_user(
+                username=f'author{i}', email=f'author{i}@example.com',
+                password='pass')
+            for i in range(3)
+        ]
+        tags = [
+            Tag.objects.create(name=f'tag{i}', slug=f'tag{i}')
+            for i in range(3)
+        ]
+        ingredients = [
+            Ingredient.objects.create(
+                name=f'ingredient{i}', measurement_unit='г')
+            for i in range(5)
+        ]
+        for i in range(8):
+            recipe = Recipe.objects.create(
+                author=authors[i % 3], name=f'recipe{i}', text='text',
+                cooking_time=10, image='recipes/image.png')
+            TagRecipe.objects.create(recipe=recipe, tag=tags[i % 3])
+            for ingredient in ingredients[:3]:
+                IngredientRecipe.objects.create(
+                    recipe=recipe, ingredient=ingredient, amount=i + 1)
+            Favorite.objects.create(user=cls.user, recipe=recipe)
+            ShoppingList.objects.create(user=cls.user, recipe=recipe)
+        Subscription.objects.create(subscriber=cls.user, author=authors[0])
+
+    def setUp(self):
+        cache.clear()
+
+    def assert_feed_queries(self, expected):
+        for limit in (2, 6):
+            with self.subTest(limit=limit):
+                cache.clear()
+                with self.assertNumQueries(expected):
+                    response = self.client.get(
+                        '/api/recipes/', {'limit': limit})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.data['results']), limit)
+
+    def test_anonymous_feed(self):
+        self.assert_feed_queries(4)
+
+    def test_authenticated_feed(self):
+        self.client.force_authenticate(self.user)
+        self.assert_feed_queries(4)
+        response = self.client.get('/api/recipes/', {'limit': 2})
+        recipe = response.data['results'][0]
+        self.assertTrue(recipe['is_favorited'])
+        self.assertTrue(recipe['is_in_shopping_cart'])
+        self.assertEqual(len(recipe['ingredients']), 3)
@@ -1,6 +1,7 @@
-from api.views import (CustomUserViewSet, FavoriteViewSet, IngredientViewSet,
-                       RecipeViewSet, ShoppongCartViewSet, SubscribeViewSet,
-                       TagViewSet)
+from api.views import (CustomUserViewSet, FavoriteBulkViewSet, FavoriteViewSet,
+                       IngredientViewSet, RecipeViewSet,
+                       ShoppingCartBulkViewSet, ShoppongCartViewSet,
+                       SubscribeBulkViewSet, SubscribeViewSet, TagViewSet)
 from django.urls import include, path
 from rest_framework import routers
 
@@ -13,6 +14,15 @@ router.register(r'ingredients', IngredientViewSet, basename='ingredients')
 router.register(r'recipes', RecipeViewSet, basename='recipes')
 
 urlpatterns = [
+    path('recipes/favorite/bulk/',
+         FavoriteBulkViewSet.as_view({'post': 'create'}),
+         name='favorite_bulk'),
+    path('recipes/shopping_cart/bulk/',
+         ShoppingCartBulkViewSet.as_view({'post': 'create'}),
+         name='shopping_cart_bulk'),
+    path('users/subscribe/bulk/',
+         SubscribeBulkViewSet.as_view({'post': 'create'}),
+         name='subscribe_bulk'),
     path(r'', include(router.urls)),
     path('recipes/<int:recipe_id>/favorite/',
          FavoriteViewSet.as_view({'post': 'create', 'delete': 'destroy'}),
@@ -1,24 +1,110 @@
-from api.filters import IngredientFilter, RecipeFilter
+import hashlib
+import time
+
+from api import feed_cache
+from api.filters import RecipeFilter
 from api.permissions import IsAdminOwnerOrReadOnly
-from api.serializers import (IngredientSerializer, RecipeGetSerializer,
-                             RecipePostPatchSerializer, RecipeShortSerializer,
-                             SubscribeSerializer, TagSerializer,
-                             UserSerializer)
-from django.db.models import Sum
-from django.http import HttpResponse
+from api.renderers import SHOPPING_CART_RENDERERS
+from api.serializers import (BulkLinkSerializer, IngredientMatchSerializer,
+                             IngredientSerializer, RecipeGetSerializer,
+                             RecipeMatchSerializer, RecipePostPatchSerializer,
+                             RecipeShortSerializer, SubscribeSerializer,
+                             TagSerializer, UserSerializer)
+from django.db import transaction
+from django.db.models import BooleanField, Exists, OuterRef, Prefetch, Value
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import (get_conditional_response, patch_vary_headers,
+                                quote_etag)
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
-from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
+from foodgram.pagination import CursorPaginationMixin
+from foodgram.settings import INGREDIENTS_SEARCH_LIMIT, MATCHING_RESULTS_LIMIT
+from recipes import matching, versions
+from recipes.catalog import get_catalog
+from recipes.models import (Favorite, Ingredient, Recipe, ShoppingCartItem,
                             ShoppingList, Tag)
 from rest_framework import mixins, status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.permissions import (IsAuthenticated,
                                         IsAuthenticatedOrReadOnly)
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from users.models import Subscription, User
 
-CONTENT_TYPE = 'text/plain'
+
+def non_field_error(message):
+    return ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [message]})
+
+
+def get_recipes_limit(request):
+    """Значение recipes_limit: None, если не передано или пустое."""
+    value = request.query_params.get('recipes_limit')
+    if not value:
+        return None
+    if not value.isdigit():
+        raise ValidationError(
+            {'recipes_limit': ['Должно быть неотрицательным целым числом.']})
+    return int(value)
+
+
+class ConditionalGetMixin:
+    """Отвечает 304 без сериализации, если данные не изменились.
+
+    ETag строится из версий данных в кэше, для авторизованного
+    пользователя в него входит и версия его избранного, покупок и подписок.
+    """
+
+    version_keys = ()
+    user_specific = False
+
+    def get_etag(self, request):
+        keys = self.version_keys
+        if self.user_specific and request.user.is_authenticated:
+            keys += (versions.user_key(request.user.id), )
+        return quote_etag(hashlib.md5(
+            ':'.join(versions.get_versions(*keys)).encode()).hexdigest())
+
+    def conditional_response(self, handler, request, *args, **kwargs):
+        etag = self.get_etag(request)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        if response.status_code in (status.HTTP_200_OK,
+                                    status.HTTP_304_NOT_MODIFIED):
+            response['ETag'] = etag
+            if self.user_specific:
+                patch_vary_headers(response, ('Authorization', ))
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(
+            super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(
+            super().retrieve, request, *args, **kwargs)
+
+
+class AnonymousFeedCacheMixin:
+    """Кэширует страницы списка, одинаковые для всех анонимных гостей."""
+
+    def list(self, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return super().list(request, *args, **kwargs)
+        key = feed_cache.make_key(request)
+        data = feed_cache.get_page(key)
+        if data is not None:
+            response = Response(data)
+            response['X-Cache'] = 'HIT'
+            return response
+        started = time.time()
+        response = super().list(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            feed_cache.set_page(key, response.data, started)
+        response['X-Cache'] = 'MISS'
+        return response
 
 
 class ListRetrieveViewSet(mixins.ListModelMixin,
@@ -33,13 +119,28 @@ class PostDeleteViewSet(mixins.CreateModelMixin,
     pass
 
 
-class CustomUserViewSet(UserViewSet):
+class CustomUserViewSet(CursorPaginationMixin, UserViewSet):
     """Вьюсет для работы с кастомной моделью User."""
 
     serializer_class = UserSerializer
     queryset = User.objects.all()
+    cursor_ordering = 'id'
     permission_classes = (IsAuthenticatedOrReadOnly, )
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action not in ('list', 'retrieve'):
+            return queryset
+        user = self.request.user
+        if user.is_authenticated:
+            subscribed = Exists(Subscription.objects.filter(
+                subscriber=user, author=OuterRef('pk')))
+        else:
+            subscribed = Value(False, output_field=BooleanField())
+        return queryset.only(
+            'email', 'id', 'username', 'first_name', 'last_name'
+        ).annotate(subscribed=subscribed)
+
     def create(self, serializer):
         serializer = self.get_serializer(data=self.request.data)
         if serializer.is_valid(raise_exception=True):
@@ -54,6 +155,8 @@ class CustomUserViewSet(UserViewSet):
     )
     def me(self, request):
         user = request.user
+        # На себя подписаться нельзя, запрос к подпискам не нужен.
+        user.subscribed = False
         serializer = self.get_serializer(user)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -63,42 +166,95 @@ class CustomUserViewSet(UserViewSet):
         permission_classes=(IsAuthenticatedOrReadOnly, ),
     )
     def subscriptions(self, request):
+        recipes_limit = get_recipes_limit(request)
         context = {
             'user': request.user,
-            'recipes_limit': request.query_params.get('recipes_limit')}
+            'recipes_limit': recipes_limit}
         queryset = User.objects.filter(
             is_subscribed__subscriber=request.user
+        ).annotate(
+            subscribed=Value(True, output_field=BooleanField())
+        ).order_by('id').prefetch_related(
+            Prefetch(
+                'recipes',
+                queryset=Recipe.objects.latest_per_author(recipes_limit),
+                to_attr='latest_recipes'
+            )
         )
         pages = self.paginate_queryset(queryset)
         serializer = SubscribeSerializer(pages, context=context, many=True)
         return self.get_paginated_response(serializer.data)
 
 
-class TagViewSet(ListRetrieveViewSet):
+class CatalogViewSet(ListRetrieveViewSet):
+    """Вьюсет справочника, который отдается из кэша в памяти процесса."""
+
+    permission_classes = (IsAuthenticatedOrReadOnly, )
+    pagination_class = None
+
+    def get_catalog_list(self, catalog):
+        raise NotImplementedError
+
+    def get_catalog_index(self, catalog):
+        raise NotImplementedError
+
+    def list(self, request, *args, **kwargs):
+        serializer = self.get_serializer(
+            self.get_catalog_list(get_catalog()), many=True)
+        return Response(serializer.data)
+
+    def retrieve(self, request, *args, **kwargs):
+        pk = kwargs[self.lookup_url_kwarg or self.lookup_field]
+        instance = None
+        if pk.isdigit():
+            instance = self.get_catalog_index(get_catalog()).get(int(pk))
+        if instance is None:
+            raise NotFound
+        serializer = self.get_serializer(instance)
+        return Response(serializer.data)
+
+
+class TagViewSet(ConditionalGetMixin, CatalogViewSet):
     """Вьюсет для получения списка и экземляра модели Tag"""
 
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
-    permission_classes = (IsAuthenticatedOrReadOnly, )
-    pagination_class = None
+    version_keys = (versions.CATALOG, )
+
+    def get_catalog_list(self, catalog):
+        return catalog.tags
 
+    def get_catalog_index(self, catalog):
+        return catalog.tags_by_id
 
-class IngredientViewSet(TagViewSet):
+
+class IngredientViewSet(ConditionalGetMixin, CatalogViewSet):
     """Вьюсет для получения списка и экземляра модели Ingredient"""
 
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
-    filter_backends = (DjangoFilterBackend, )
-    filterset_class = IngredientFilter
-    permission_classes = (IsAuthenticatedOrReadOnly,)
+    version_keys = (versions.CATALOG, )
+
+    def get_catalog_list(self, catalog):
+        return catalog.search_ingredients(
+            self.request.query_params.get('name'), INGREDIENTS_SEARCH_LIMIT)
 
+    def get_catalog_index(self, catalog):
+        return catalog.ingredients_by_id
 
-class RecipeViewSet(viewsets.ModelViewSet):
+
+class RecipeViewSet(ConditionalGetMixin, AnonymousFeedCacheMixin,
+                    CursorPaginationMixin, viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
     serializer_class = RecipeGetSerializer
     permission_classes = (IsAuthenticatedOrReadOnly, )
     filter_backends = (DjangoFilterBackend, )
     filterset_class = RecipeFilter
+    version_keys = (versions.RECIPES, versions.CATALOG)
+    user_specific = True
+
+    def get_queryset(self):
+        return Recipe.objects.for_feed(self.request.user)
 
     def get_serializer_class(self):
         if self.action == 'list' or self.action == 'retrieve':
@@ -114,25 +270,56 @@ class RecipeViewSet(viewsets.ModelViewSet):
     @action(
         methods=('get', ),
         detail=False,
+        permission_classes=(IsAuthenticated, ),
+        renderer_classes=SHOPPING_CART_RENDERERS
     )
     def download_shopping_cart(self, request):
-        ingredients = IngredientRecipe.objects.filter(
-            recipe__is_in_shopping_list__user=request.user
-        ).values(
-            'ingredient__name', 'ingredient__measurement_unit'
-        ).order_by(
-            'ingredient__name'
-        ).annotate(ingredient_sum=Sum('amount'))
-        data = []
-        data.append('Список ингредиентов для покупки:')
-        data.append('Ингредиент | количество  | ед.изм')
-
-        for obj in ingredients:
-            name = obj.get('ingredient__name')
-            measurement = obj.get('ingredient__measurement_unit')
-            amount = obj.get('ingredient_sum')
-            data.append(f'{name} | {amount} | {measurement}')
-        return HttpResponse("\r\n".join(data), content_type=CONTENT_TYPE)
+        ingredients = ShoppingCartItem.objects.filter(
+            user=request.user
+        ).values_list(
+            'ingredient__name', 'ingredient__measurement_unit', 'total_amount'
+        ).order_by('ingredient__name')
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(
+            renderer.stream(ingredients.iterator()),
+            content_type=f'{renderer.media_type}; charset={renderer.charset}'
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="shopping_cart.{renderer.extension}"'
+        )
+        return response
+
+    @action(methods=('get', ), detail=False)
+    def what_can_i_cook(self, request):
+        params = IngredientMatchSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        index = matching.get_index()
+        matches = index.match(
+            [ingredient.pk for ingredient in params.validated_data[
+                'ingredients']],
+            params.validated_data['min_coverage'],
+            limit=MATCHING_RESULTS_LIMIT
+        )
+        # Ранжированный список id из памяти режется на страницы как
+        # обычный список, курсорная пагинация к нему неприменима.
+        self._paginator = self.pagination_class()
+        page = self.paginate_queryset(matches)
+        rows = page if page is not None else matches
+        recipes = self.get_queryset().in_bulk(
+            [recipe_id for recipe_id, _ in rows])
+        index.discard(
+            recipe_id for recipe_id, _ in rows if recipe_id not in recipes)
+        results = []
+        for recipe_id, coverage in rows:
+            recipe = recipes.get(recipe_id)
+            if recipe is not None:
+                recipe.coverage = coverage
+                results.append(recipe)
+        serializer = RecipeMatchSerializer(
+            results, many=True, context=self.get_serializer_context())
+        if page is not None:
+            return self.get_paginated_response(serializer.data)
+        return Response(serializer.data)
 
 
 class FavoriteViewSet(PostDeleteViewSet):
@@ -140,61 +327,46 @@ class FavoriteViewSet(PostDeleteViewSet):
 
     serializer_class = RecipeShortSerializer
     permission_classes = (IsAuthenticated, )
+    model = Favorite
+    exists_error = 'Этот рецепт уже есть в избранном!'
+    missing_error = 'Такого рецепта нет в избранном!'
+    removed_message = 'Рецепт успешно удален из избранного'
 
     def create(self, request, **kwargs):
-        recipe = get_object_or_404(Recipe, id=kwargs.get('recipe_id'))
-        context = {
-            'user': request.user,
-            'model': 'favorite'
-        }
-        serializer = RecipeShortSerializer(
-            recipe, data=request.data, context=context
+        recipe = get_object_or_404(
+            Recipe.objects.only(
+                'id', 'name', 'image', 'cooking_time', 'renditions_ready'),
+            id=kwargs.get('recipe_id')
         )
-        serializer.is_valid(raise_exception=True)
-        Favorite.objects.create(user=request.user, recipe=recipe)
+        with transaction.atomic():
+            if not self.model.objects.add(user=request.user, recipe=recipe):
+                raise non_field_error(self.exists_error)
+        serializer = RecipeShortSerializer(recipe)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     def destroy(self, request, **kwargs):
-        recipe = get_object_or_404(Recipe, id=kwargs.get('recipe_id'))
-        obj = recipe.is_favorited.filter(user=request.user)
-        if obj.exists():
-            obj.delete()
+        recipe_id = kwargs.get('recipe_id')
+        with transaction.atomic():
+            removed = self.model.objects.remove(
+                user=request.user, recipe_id=recipe_id)
+        if removed:
             return Response(
-                {'message': 'Рецепт успешно удален из избранного'},
+                {'message': self.removed_message},
                 status=status.HTTP_204_NO_CONTENT)
+        if not Recipe.objects.filter(id=recipe_id).exists():
+            raise NotFound
         return Response(
-            {'errors': 'Такого рецепта нет в избранном!'},
+            {'errors': self.missing_error},
             status=status.HTTP_400_BAD_REQUEST)
 
 
 class ShoppongCartViewSet(FavoriteViewSet):
     serializer_class = RecipeShortSerializer
     permission_classes = (IsAuthenticated, )
-
-    def create(self, request, **kwargs):
-        recipe = get_object_or_404(Recipe, id=kwargs.get('recipe_id'))
-        context = {
-            'user': request.user,
-            'model': 'shopping_cart'
-        }
-        serializer = RecipeShortSerializer(
-            recipe, data=request.data, context=context
-        )
-        serializer.is_valid(raise_exception=True)
-        ShoppingList.objects.create(user=request.user, recipe=recipe)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
-
-    def destroy(self, request, **kwargs):
-        recipe = get_object_or_404(Recipe, id=kwargs.get('recipe_id'))
-        obj = recipe.is_in_shopping_list.filter(user=request.user)
-        if obj.exists():
-            obj.delete()
-            return Response(
-                {'message': 'Рецепт успешно удален из списка покупок'},
-                status=status.HTTP_204_NO_CONTENT)
-        return Response(
-            {'errors': 'Такого рецепта нет в списке покупок!'},
-            status=status.HTTP_400_BAD_REQUEST)
+    model = ShoppingList
+    exists_error = 'Этот рецепт уже есть в списке покупок!'
+    missing_error = 'Такого рецепта нет в списке покупок!'
+    removed_message = 'Рецепт успешно удален из списка покупок'
 
 
 class SubscribeViewSet(PostDeleteViewSet):
@@ -204,26 +376,140 @@ class SubscribeViewSet(PostDeleteViewSet):
     permission_classes = (IsAuthenticated, )
 
     def create(self, request, **kwargs):
+        recipes_limit = get_recipes_limit(request)
         author = get_object_or_404(User, id=kwargs.get('user_id'))
+        if author == request.user:
+            raise non_field_error('Нельзя подписаться на самого себя')
+        with transaction.atomic():
+            if not Subscription.objects.add(
+                subscriber=request.user, author=author
+            ):
+                raise non_field_error('Вы уже пописаны на этого автора')
+        author.subscribed = True
         context = {
             'user': request.user,
-            'recipes_limit': request.query_params.get('recipes_limit')}
-        serializer = SubscribeSerializer(
-            author, data=request.data, context=context
-        )
-        serializer.is_valid(raise_exception=True)
-        Subscription.objects.create(
-            subscriber=request.user, author_id=author.id)
+            'recipes_limit': recipes_limit}
+        serializer = SubscribeSerializer(author, context=context)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     def destroy(self, request, **kwargs):
-        author = get_object_or_404(User, id=kwargs.get('user_id'))
-        obj = author.is_subscribed.filter(subscriber=request.user)
-        if obj.exists():
-            obj.delete()
+        author_id = kwargs.get('user_id')
+        with transaction.atomic():
+            removed = Subscription.objects.remove(
+                subscriber=request.user, author_id=author_id)
+        if removed:
             return Response(
                 {'message': 'Автор успешно удален из подписки'},
                 status=status.HTTP_204_NO_CONTENT)
+        if not User.objects.filter(id=author_id).exists():
+            raise NotFound
         return Response(
             {'errors': 'Подписки на этого автора не существует!'},
             status=status.HTTP_400_BAD_REQUEST)
+
+
+class BulkLinkViewSet(viewsets.GenericViewSet):
+    """Пакетное добавление и удаление связей пользователя с объектами.
+
+    Все id проверяются одним запросом, изменения применяются одним INSERT
+    и одним DELETE с RETURNING: результат и пересчеты строятся по строкам,
+    которые действительно добавлены или удалены, даже при параллельных
+    запросах. Сигналы при этом не отправляются, поэтому счетчики
+    пересчитываются одним UPDATE, а версия кэша пользователя меняется явно.
+    В ответе указан результат для каждого id.
+    """
+
+    serializer_class = BulkLinkSerializer
+    permission_classes = (IsAuthenticated, )
+    model = None
+    target_model = None
+    user_field = 'user'
+    target_field = 'recipe'
+    counter_field = None
+
+    def get_links(self, user):
+        return self.model.objects.filter(**{self.user_field: user})
+
+    def can_add(self, user, target_id):
+        return True
+
+    def on_changed(self, user, added, removed):
+        pass
+
+    def create(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user = request.user
+        add = serializer.validated_data['add']
+        remove = serializer.validated_data['remove']
+        found = set(self.target_model.objects.filter(
+            pk__in=add + remove).values_list('pk', flat=True))
+        add_results, remove_results = {}, {}
+        for target_id in add:
+            if target_id not in found:
+                add_results[target_id] = 'not_found'
+            elif not self.can_add(user, target_id):
+                add_results[target_id] = 'invalid'
+        for target_id in remove:
+            if target_id not in found:
+                remove_results[target_id] = 'not_found'
+        to_remove = [
+            target_id for target_id in remove
+            if target_id not in remove_results
+        ]
+        target_id_field = f'{self.target_field}_id'
+        with transaction.atomic():
+            added = self.model.objects.bulk_add(
+                ({self.user_field: user, target_id_field: target_id}
+                 for target_id in add if target_id not in add_results),
+                returning=target_id_field
+            )
+            removed = self.get_links(user).filter(
+                **{f'{target_id_field}__in': to_remove}
+            ).bulk_remove(returning=target_id_field) if to_remove else []
+            if added or removed:
+                if self.counter_field:
+                    self.target_model.recount_counter(
+                        added + removed, self.counter_field,
+                        self.model, self.target_field)
+                self.on_changed(user, added, removed)
+                versions.bump_on_commit(versions.user_key(user.id))
+        for target_id in add:
+            add_results.setdefault(
+                target_id, 'added' if target_id in added else 'exists')
+        for target_id in remove:
+            remove_results.setdefault(
+                target_id, 'removed' if target_id in removed else 'missing')
+        return Response({
+            'add': [{'id': target_id, 'status': add_results[target_id]}
+                    for target_id in add],
+            'remove': [
+                {'id': target_id, 'status': remove_results[target_id]}
+                for target_id in remove
+            ],
+        })
+
+
+class FavoriteBulkViewSet(BulkLinkViewSet):
+    model = Favorite
+    target_model = Recipe
+    counter_field = 'favorites_count'
+
+
+class ShoppingCartBulkViewSet(BulkLinkViewSet):
+    model = ShoppingList
+    target_model = Recipe
+
+    def on_changed(self, user, added, removed):
+        ShoppingCartItem.objects.change_recipes(user.id, added, removed)
+
+
+class SubscribeBulkViewSet(BulkLinkViewSet):
+    model = Subscription
+    target_model = User
+    user_field = 'subscriber'
+    target_field = 'author'
+    counter_field = 'subscribers_count'
+
+    def can_add(self, user, target_id):
+        return target_id != user.id
@@ -0,0 +1,227 @@
+"""Замеры времени запросов к API.
+
+Middleware считает время и число SQL-запросов через
+connection.execute_wrapper, время вьюхи и время рендеринга ответа DRF
+(через process_template_response и post-render callback). Сотрудникам и
+запросам с заголовком X-Debug-Token замеры отдаются в Server-Timing.
+Гистограммы времени по маршрутам копятся в памяти процесса и раз в
+REQUEST_STATS_FLUSH_INTERVAL секунд записываются в общий кэш одной
+записью на процесс, откуда их суммирует команда request_stats.
+Медленные запросы пишутся в лог вместе с самыми частыми повторяющимися
+SQL-запросами, что выдает N+1.
+SQL, выполняемый при отдаче StreamingHttpResponse, уже не учитывается.
+"""
+import hmac
+import logging
+import re
+import time
+from collections import Counter, defaultdict
+from threading import Lock
+from uuid import uuid4
+
+from django.core.cache import cache
+from django.db import connection
+from foodgram.settings import (REQUEST_STATS_FLUSH_INTERVAL,
+                               SERVER_TIMING_TOKEN, SLOW_REQUEST_MS)
+
+BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500)
+FIELDS = ('count', 'total_us', 'db_us', 'queries')
+RESET_KEY = 'foodgram:requests:reset'
+WORKERS_KEY = 'foodgram:requests:workers'
+# Записи процессов, которые давно не сбрасывали статистику, удаляются.
+STATS_TIMEOUT = 7 * 24 * 60 * 60
+TOP_FINGERPRINTS = 5
+STRING = re.compile(r"'(?:[^']|'')*'")
+NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+PLACEHOLDERS = re.compile(r'\(\s*(?:%s|\?)(?:\s*,\s*(?:%s|\?))*\s*\)')
+SPACES = re.compile(r'\s+')
+
+logger = logging.getLogger(__name__)
+
+
+def fingerprint(sql):
+    """SQL без конкретных значений: одинаков для повторов одного запроса."""
+    sql = NUMBER.sub('?', STRING.sub('?', sql))
+    return SPACES.sub(' ', PLACEHOLDERS.sub('(...)', sql)).strip()
+
+
+def worker_key(worker_id):
+    return f'foodgram:requests:worker:{worker_id}'
+
+
+def bucket_fields():
+    return [f'le_{limit}' for limit in BUCKETS_MS] + ['le_inf']
+
+
+class QueryRecorder:
+    """Обертка execute_wrapper, запоминающая SQL и длительность."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.perf_counter() - started))
+
+    @property
+    def duration(self):
+        return sum(duration for _, duration in self.queries)
+
+    def repeated(self):
+        """Самые частые повторяющиеся запросы: (число, секунды, SQL)."""
+        counts = Counter()
+        durations = defaultdict(float)
+        for sql, duration in self.queries:
+            key = fingerprint(sql)
+            counts[key] += 1
+            durations[key] += duration
+        return [
+            (count, durations[key], key)
+            for key, count in counts.most_common(TOP_FINGERPRINTS)
+            if count > 1
+        ]
+
+
+class RouteStats:
+    """Гистограммы времени по маршрутам, накопленные в процессе.
+
+    Процесс хранит в общем кэше одну запись со своими итогами с момента
+    запуска и перезаписывает ее целиком, поэтому одновременные сбросы
+    разных процессов не теряют счетчики, а записей в кэше не больше,
+    чем процессов.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.worker_id = uuid4().hex
+        self.totals = defaultdict(Counter)
+        self.reset_version = None
+        self.flushed_at = time.monotonic()
+
+    def record(self, route, total, db, queries):
+        total_ms = total * 1000
+        bucket = next(
+            (f'le_{limit}' for limit in BUCKETS_MS if total_ms <= limit),
+            'le_inf')
+        with self.lock:
+            self.totals[route].update({
+                'count': 1,
+                'total_us': int(total * 1e6),
+                'db_us': int(db * 1e6),
+                'queries': queries,
+                bucket: 1,
+            })
+            if time.monotonic() - self.flushed_at < (
+                    REQUEST_STATS_FLUSH_INTERVAL):
+                return
+            self.flushed_at = time.monotonic()
+        self.flush()
+
+    def flush(self):
+        reset_version = cache.get(RESET_KEY, '')
+        with self.lock:
+            if self.reset_version is None:
+                self.reset_version = reset_version
+            elif reset_version != self.reset_version:
+                # Счетчики обнулили: накопленное с прошлой записи отбрасываем.
+                self.reset_version = reset_version
+                self.totals.clear()
+            totals = {
+                route: dict(values) for route, values in self.totals.items()
+            }
+        cache.set(worker_key(self.worker_id), totals, STATS_TIMEOUT)
+        now = time.time()
+        workers = {
+            worker_id: flushed_at
+            for worker_id, flushed_at in (cache.get(WORKERS_KEY) or {}).items()
+            if now - flushed_at < STATS_TIMEOUT
+        }
+        workers[self.worker_id] = now
+        cache.set(WORKERS_KEY, workers, None)
+
+
+route_stats = RouteStats()
+
+
+def get_stats():
+    """Сумма счетчиков по маршрутам из записей всех процессов."""
+    workers = cache.get(WORKERS_KEY) or {}
+    stats = defaultdict(Counter)
+    for totals in cache.get_many(map(worker_key, workers)).values():
+        for route, values in totals.items():
+            stats[route].update(values)
+    fields = FIELDS + tuple(bucket_fields())
+    return {
+        route: {field: values[field] for field in fields}
+        for route, values in sorted(stats.items())
+    }
+
+
+def reset_stats():
+    workers = cache.get(WORKERS_KEY) or {}
+    cache.set(RESET_KEY, uuid4().hex, None)
+    cache.delete_many([worker_key(worker_id) for worker_id in workers])
+    cache.delete(WORKERS_KEY)
+
+
+class InstrumentationMiddleware:
+    """Замеряет запрос; должна стоять первой в MIDDLEWARE."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.timings = {'started': time.perf_counter()}
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+        timings = request.timings
+        finished = time.perf_counter()
+        total = finished - timings['started']
+        view = timings.get('view_finished', finished) - timings.get(
+            'view_started', timings['started'])
+        render = timings.get('rendered', 0) - timings.get('view_finished', 0)
+        db = recorder.duration
+        match = request.resolver_match
+        route = f'{request.method} {match.view_name if match else "-"}'
+        route_stats.record(route, total, db, len(recorder.queries))
+        if total * 1000 >= SLOW_REQUEST_MS:
+            logger.warning(
+                'Медленный запрос %s %s: %.0f мс, SQL: %d запросов '
+                '%.0f мс%s', request.method, request.get_full_path(),
+                total * 1000, len(recorder.queries), db * 1000, ''.join(
+                    f'\n  {count} x {duration * 1000:.1f} мс: {sql}'
+                    for count, duration, sql in recorder.repeated()))
+        if self.timing_allowed(request):
+            response['Server-Timing'] = ', '.join((
+                f'db;dur={db * 1000:.1f};desc="{len(recorder.queries)} SQL"',
+                f'view;dur={view * 1000:.1f}',
+                f'render;dur={max(render, 0) * 1000:.1f}',
+                f'total;dur={total * 1000:.1f}',
+            ))
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.timings['view_started'] = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        # Ответы DRF рендерятся после всех process_template_response,
+        # эта middleware первая в списке и вызывается последней.
+        request.timings['view_finished'] = time.perf_counter()
+
+        def rendered(response):
+            request.timings['rendered'] = time.perf_counter()
+
+        response.add_post_render_callback(rendered)
+        return response
+
+    def timing_allowed(self, request):
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_staff:
+            return True
+        token = request.headers.get('X-Debug-Token')
+        return bool(SERVER_TIMING_TOKEN and token and hmac.compare_digest(
+            token, SERVER_TIMING_TOKEN))
@@ -1,5 +1,45 @@
-from rest_framework.pagination import PageNumberPagination
+from django.core.paginator import Paginator
+from django.db.models import QuerySet
+from django.utils.functional import cached_property
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+CURSOR_PAGINATION_PARAM = 'pagination'
+
+
+class CountPaginator(Paginator):
+    """Считает строки без аннотаций и сортировки исходного запроса."""
+
+    @cached_property
+    def count(self):
+        if isinstance(self.object_list, QuerySet):
+            return self.object_list.values('pk').order_by().count()
+        return super().count
 
 
 class CustomLimitPagintaion(PageNumberPagination):
     page_size_query_param = 'limit'
+    django_paginator_class = CountPaginator
+
+
+class CustomCursorPagination(CursorPagination):
+    """Постраничный вывод по ключу без COUNT(*) и OFFSET."""
+
+    page_size = 6
+    page_size_query_param = 'limit'
+    ordering = '-id'
+
+
+class CursorPaginationMixin:
+    """Включает курсорную пагинацию по параметру ?pagination=cursor."""
+
+    cursor_pagination_class = CustomCursorPagination
+    cursor_ordering = '-id'
+
+    @property
+    def paginator(self):
+        if (not hasattr(self, '_paginator')
+                and self.request.query_params.get(
+                    CURSOR_PAGINATION_PARAM) == 'cursor'):
+            self._paginator = self.cursor_pagination_class()
+            self._paginator.ordering = self.cursor_ordering
+        return super().paginator
@@ -21,6 +21,23 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 
 MIN_COOKING_TIME = 1
 MIN_AMOUNT = 1
+INGREDIENTS_SEARCH_LIMIT = 20
+FEED_CACHE_TIMEOUT = 60 * 10
+BULK_LINKS_LIMIT = 100
+MATCHING_INGREDIENTS_LIMIT = 50
+MATCHING_RESULTS_LIMIT = 1000
+MATCHING_REBUILD_INTERVAL = 60 * 60
+IMAGE_MAX_SIZE = 10 * 1024 * 1024
+IMAGE_MAX_DIMENSION = 8000
+IMAGE_RENDITIONS = {
+    'thumbnail': 300,
+    'medium': 800,
+    'full': 1600,
+}
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', 2))
+SERVER_TIMING_TOKEN = os.getenv('SERVER_TIMING_TOKEN', '')
+SLOW_REQUEST_MS = int(os.getenv('SLOW_REQUEST_MS', 500))
+REQUEST_STATS_FLUSH_INTERVAL = 60
 
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'static/')
@@ -63,6 +80,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'foodgram.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -107,6 +125,24 @@ DATABASES = {
     }
 }
 
+# В default лежат страницы ленты, версии отдельных пользователей и
+# статистика запросов: при переполнении FileBasedCache удаляет случайную
+# треть записей, что приводит только к повторному расчету. Общие версии
+# данных хранятся отдельно, их всего несколько и вытеснять их нечем.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', '/var/tmp/foodgram_cache'),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 20000)),
+        },
+    },
+    'versions': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.getenv('VERSIONS_CACHE_LOCATION', '/var/tmp/foodgram_versions'),
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -1,6 +1,6 @@
 from django.contrib import admin
 from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
-                            ShoppingList, Tag, TagRecipe)
+                            ShoppingCartItem, ShoppingList, Tag, TagRecipe)
 
 
 @admin.register(Tag)
@@ -53,9 +53,10 @@ class RecipeAdmin(admin.ModelAdmin):
     )
 
     def in_favorite(self, obj):
-        return obj.is_favorited.count()
+        return obj.favorites_count
 
     in_favorite.short_description = 'Количество добавлений в избранное'
+    in_favorite.admin_order_field = 'favorites_count'
 
 
 @admin.register(TagRecipe)
@@ -113,3 +114,13 @@ class ShoppingListAdmin(admin.ModelAdmin):
     list_filter = (
         'recipe__tags',
     )
+
+
+@admin.register(ShoppingCartItem)
+class ShoppingCartItemAdmin(admin.ModelAdmin):
+    list_display = ('pk', 'user', 'ingredient', 'total_amount')
+    search_fields = (
+        'user__username',
+        'user__email',
+        'ingredient__name'
+    )
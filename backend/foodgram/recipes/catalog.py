@@ -0,0 +1,104 @@
+"""Кэш справочников тегов и ингредиентов в памяти процесса.
+
+Справочники меняются редко, поэтому каждый процесс держит их неизменяемую
+копию и перечитывает её из базы только при смене версии в общем кэше.
+Версию меняют сигналы моделей Tag и Ingredient.
+"""
+from bisect import bisect_left
+from collections import namedtuple
+from threading import Lock
+
+from recipes import versions
+
+
+class TagEntry(namedtuple('TagEntry', ('id', 'name', 'color', 'slug'))):
+    __slots__ = ()
+
+    @property
+    def pk(self):
+        return self.id
+
+    def __str__(self):
+        return self.name
+
+
+class IngredientEntry(namedtuple('IngredientEntry',
+                                 ('id', 'name', 'measurement_unit'))):
+    __slots__ = ()
+
+    @property
+    def pk(self):
+        return self.id
+
+    def __str__(self):
+        return self.name
+
+
+class Catalog:
+    """Неизменяемый снимок справочников одной версии."""
+
+    __slots__ = ('version', 'tags', 'tags_by_id', 'ingredients',
+                 'ingredients_by_id', '_names')
+
+    def __init__(self, version, tags, ingredients):
+        self.version = version
+        self.tags = tuple(tags)
+        self.tags_by_id = {tag.id: tag for tag in self.tags}
+        self.ingredients = tuple(
+            sorted(ingredients, key=lambda item: item.name.lower()))
+        self.ingredients_by_id = {
+            ingredient.id: ingredient for ingredient in self.ingredients
+        }
+        self._names = tuple(
+            ingredient.name.lower() for ingredient in self.ingredients)
+
+    def search_ingredients(self, value, limit):
+        """Ингредиенты, начинающиеся с value, затем содержащие его."""
+        if not value:
+            return self.ingredients[:limit]
+        value = value.lower()
+        result = []
+        index = bisect_left(self._names, value)
+        while (len(result) < limit and index < len(self._names)
+               and self._names[index].startswith(value)):
+            result.append(self.ingredients[index])
+            index += 1
+        for name, ingredient in zip(self._names, self.ingredients):
+            if len(result) >= limit:
+                break
+            if value in name and not name.startswith(value):
+                result.append(ingredient)
+        return result
+
+
+_catalog = None
+_lock = Lock()
+
+
+def load(version):
+    from recipes.models import Ingredient, Tag
+
+    return Catalog(
+        version,
+        (TagEntry(*row) for row in Tag.objects.values_list(
+            'id', 'name', 'color', 'slug')),
+        (IngredientEntry(*row) for row in Ingredient.objects.values_list(
+            'id', 'name', 'measurement_unit'))
+    )
+
+
+def get_catalog():
+    global _catalog
+    version = versions.get_version(versions.CATALOG)
+    catalog = _catalog
+    if catalog is not None and catalog.version == version:
+        return catalog
+    with _lock:
+        catalog = _catalog
+        if catalog is None or catalog.version != version:
+            _catalog = catalog = load(version)
+    return catalog
+
+
+def invalidate():
+    versions.bump(versions.CATALOG)
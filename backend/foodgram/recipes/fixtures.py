@@ -0,0 +1,319 @@
+"""Синтетические данные для нагрузочных замеров.
+
+Все записи одного набора помечены префиксом в именах, поэтому набор
+можно найти и повторно не создавать. Id пользователей и рецептов
+назначаются заранее подряд, поэтому рецепты и связи генерируются
+независимыми частями: каждая часть получает свой генератор случайных
+чисел от seed и номера части, и результат не зависит от числа процессов.
+Популярность авторов, рецептов и ингредиентов распределена по Ципфу.
+
+Строки вставляются через bulk_create пачками или через COPY в
+PostgreSQL, сигналы не отправляются: счетчики и списки покупок
+пересчитываются командами reconcile_counters и rebuild_shopping_cart.
+"""
+import multiprocessing
+import os
+import random
+from bisect import bisect_left
+from itertools import accumulate, islice
+from math import gcd
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.color import no_style
+from django.db import connection, connections, transaction
+from django.db.models import Max
+from recipes import versions
+from recipes.management.commands.load_ingredients import DATA_DIR, CSVStream
+from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
+                            ShoppingList, Tag, TagRecipe)
+from users.models import Subscription, User
+
+SCALES = {'10k': 10000, '100k': 100000, '1m': 1000000}
+CATALOG_PATH = os.path.join(DATA_DIR, 'ingredients.csv')
+PASSWORD = 'synthetic-password'
+IMAGE = 'recipes/images/synthetic.jpg'
+RECIPES_PER_USER = 10
+MIN_INGREDIENTS = 5
+MAX_INGREDIENTS = 30
+TAGS_PER_RECIPE = (1, 3)
+FAVORITES_PER_USER = 20
+CART_RECIPES_PER_USER = 3
+SUBSCRIPTIONS_PER_USER = 5
+ZIPF_EXPONENT = 1.1
+CHUNK_SIZE = 10000
+FIRST_NAMES = ('Анна', 'Мария', 'Елена', 'Ольга', 'Наталья', 'Ирина',
+               'Александр', 'Сергей', 'Дмитрий', 'Андрей', 'Алексей',
+               'Максим', 'Татьяна', 'Светлана', 'Иван', 'Павел')
+LAST_NAMES = ('Иванов', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев',
+              'Петров', 'Соколов', 'Михайлов', 'Новиков', 'Федоров',
+              'Морозов', 'Волков', 'Алексеев', 'Лебедев', 'Семенов')
+TAG_NAMES = ('Завтрак', 'Обед', 'Ужин', 'Десерт', 'Выпечка', 'Салаты',
+             'Супы', 'Напитки', 'Постное', 'Праздничное')
+DISHES = ('Суп', 'Салат', 'Пирог', 'Каша', 'Рагу', 'Запеканка', 'Омлет',
+          'Плов', 'Борщ', 'Паста', 'Соус', 'Жаркое')
+ADJECTIVES = ('грибной', 'овощной', 'домашний', 'острый', 'сырный',
+              'куриный', 'рыбный', 'летний', 'постный', 'праздничный')
+STEPS = ('Нарезать и обжарить на среднем огне.',
+         'Довести до кипения и варить под крышкой.',
+         'Перемешать и оставить настояться.',
+         'Выпекать в разогретой духовке до румяной корочки.',
+         'Подавать горячим, посыпав зеленью.')
+
+
+class FixturesExistError(Exception):
+    pass
+
+
+class ZipfSampler:
+    """Выборка id из непрерывного диапазона с распределением Ципфа.
+
+    Ранг переводится в id умножением на взаимно простой с размером шаг,
+    чтобы популярные объекты не шли подряд с начала диапазона.
+    """
+
+    def __init__(self, first_id, size, exponent=ZIPF_EXPONENT):
+        self.first_id = first_id
+        self.size = size
+        self.cum_weights = list(accumulate(
+            rank ** -exponent for rank in range(1, size + 1)))
+        self.step = size // 2 + 1
+        while gcd(self.step, size) != 1:
+            self.step += 1
+
+    def sample(self, randomizer):
+        rank = bisect_left(
+            self.cum_weights, randomizer.random() * self.cum_weights[-1])
+        return self.first_id + rank * self.step % self.size
+
+    def unique(self, randomizer, count, exclude=None):
+        count = min(count, self.size - (exclude is not None))
+        chosen = set()
+        while len(chosen) < count:
+            item = self.sample(randomizer)
+            if item != exclude:
+                chosen.add(item)
+        return sorted(chosen)
+
+
+class Plan:
+    """Параметры набора, которые передаются в процессы-исполнители."""
+
+    def __init__(self, seed, users, recipes, batch_size, use_copy):
+        self.seed = seed
+        self.prefix = f'synthetic{seed}'
+        self.users = users
+        self.recipes = recipes
+        self.batch_size = batch_size
+        self.use_copy = use_copy
+        self.first_user_id = (
+            User.objects.aggregate(last=Max('id'))['last'] or 0) + 1
+        self.first_recipe_id = (
+            Recipe.objects.aggregate(last=Max('id'))['last'] or 0) + 1
+        self.tag_ids = []
+        self.ingredients = []
+
+    def randomizer(self, stage, start):
+        return random.Random(f'{self.seed}:{stage}:{start}')
+
+
+_samplers = {}
+
+
+def get_sampler(first_id, size):
+    key = (first_id, size)
+    if key not in _samplers:
+        _samplers[key] = ZipfSampler(first_id, size)
+    return _samplers[key]
+
+
+def batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def copy_rows(model, objects):
+    """Записывает объекты через COPY со значениями, как при bulk_create."""
+    if not objects:
+        return
+    fields = [
+        field for field in model._meta.concrete_fields
+        if not field.primary_key or objects[0].pk is not None
+    ]
+    rows = (
+        [field.get_db_prep_save(field.pre_save(obj, True), connection)
+         for field in fields]
+        for obj in objects
+    )
+    columns = ', '.join(
+        connection.ops.quote_name(field.column) for field in fields)
+    with connection.cursor() as cursor:
+        cursor.copy_expert(
+            f'COPY {connection.ops.quote_name(model._meta.db_table)} '
+            f'({columns}) FROM STDIN WITH (FORMAT csv)',
+            CSVStream(rows)
+        )
+
+
+def insert(model, objects, plan):
+    if plan.use_copy:
+        copy_rows(model, list(objects))
+        return
+    for batch in batches(objects, plan.batch_size):
+        model.objects.bulk_create(
+            batch, batch_size=plan.batch_size, ignore_conflicts=True)
+
+
+def generate_users(plan):
+    randomizer = plan.randomizer('users', 0)
+    password = make_password(PASSWORD)
+    insert(User, (
+        User(id=plan.first_user_id + number,
+             username=f'{plan.prefix}_{number}',
+             email=f'{plan.prefix}_{number}@example.com',
+             first_name=randomizer.choice(FIRST_NAMES),
+             last_name=randomizer.choice(LAST_NAMES),
+             password=password)
+        for number in range(plan.users)
+    ), plan)
+    insert(Tag, (
+        Tag(name=f'{name} {plan.prefix}', slug=f'{plan.prefix}-tag-{number}',
+            color=f'#{randomizer.randrange(0x1000000):06X}')
+        for number, name in enumerate(TAG_NAMES)
+    ), plan)
+
+
+def generate_recipes(plan, start, stop):
+    """Рецепты с номерами start..stop, их теги и ингредиенты."""
+    randomizer = plan.randomizer('recipes', start)
+    authors = get_sampler(plan.first_user_id, plan.users)
+    catalog = get_sampler(0, len(plan.ingredients))
+    recipes, tags, amounts = [], [], []
+    for number in range(start, stop):
+        recipe_id = plan.first_recipe_id + number
+        ingredients = [
+            plan.ingredients[position] for position in catalog.unique(
+                randomizer,
+                randomizer.randint(MIN_INGREDIENTS, MAX_INGREDIENTS))
+        ]
+        recipes.append(Recipe(
+            id=recipe_id,
+            author_id=authors.sample(randomizer),
+            name=f'{randomizer.choice(DISHES)} '
+                 f'{randomizer.choice(ADJECTIVES)} {plan.prefix}-{number}',
+            text=(f'Понадобится: {", ".join(name for _, name in ingredients)}'
+                  f'. {" ".join(randomizer.sample(STEPS, 3))}'),
+            image=IMAGE,
+            cooking_time=randomizer.randint(5, 180)
+        ))
+        tags.extend(
+            TagRecipe(recipe_id=recipe_id, tag_id=tag_id)
+            for tag_id in randomizer.sample(
+                plan.tag_ids, randomizer.randint(*TAGS_PER_RECIPE)))
+        amounts.extend(
+            IngredientRecipe(recipe_id=recipe_id, ingredient_id=ingredient_id,
+                             amount=randomizer.randint(1, 500))
+            for ingredient_id, _ in ingredients)
+    with transaction.atomic():
+        insert(Recipe, recipes, plan)
+        insert(TagRecipe, tags, plan)
+        insert(IngredientRecipe, amounts, plan)
+    return stop - start
+
+
+def generate_links(plan, start, stop):
+    """Избранное, списки покупок и подписки пользователей start..stop."""
+    randomizer = plan.randomizer('links', start)
+    recipes = get_sampler(plan.first_recipe_id, plan.recipes)
+    authors = get_sampler(plan.first_user_id, plan.users)
+    favorites, carts, subscriptions = [], [], []
+    for number in range(start, stop):
+        user_id = plan.first_user_id + number
+        favorites.extend(
+            Favorite(user_id=user_id, recipe_id=recipe_id)
+            for recipe_id in recipes.unique(
+                randomizer, randomizer.randint(0, 2 * FAVORITES_PER_USER)))
+        carts.extend(
+            ShoppingList(user_id=user_id, recipe_id=recipe_id)
+            for recipe_id in sorted({
+                plan.first_recipe_id + randomizer.randrange(plan.recipes)
+                for _ in range(randomizer.randint(
+                    0, 2 * CART_RECIPES_PER_USER))}))
+        subscriptions.extend(
+            Subscription(subscriber_id=user_id, author_id=author_id)
+            for author_id in authors.unique(
+                randomizer, randomizer.randint(0, 2 * SUBSCRIPTIONS_PER_USER),
+                exclude=user_id))
+    with transaction.atomic():
+        insert(Favorite, favorites, plan)
+        insert(ShoppingList, carts, plan)
+        insert(Subscription, subscriptions, plan)
+    return stop - start
+
+
+def run_task(task):
+    function, plan, start, stop = task
+    return function(plan, start, stop)
+
+
+def run_chunks(function, plan, total, processes, stdout=None):
+    tasks = [
+        (function, plan, start, min(start + CHUNK_SIZE, total))
+        for start in range(0, total, CHUNK_SIZE)
+    ]
+    if processes > 1:
+        # Процессы-исполнители открывают собственные соединения.
+        connections.close_all()
+        pool = multiprocessing.get_context('fork').Pool(processes)
+        results = pool.imap_unordered(run_task, tasks)
+    else:
+        pool = None
+        results = map(run_task, tasks)
+    try:
+        done = 0
+        for count in results:
+            done += count
+            if stdout is not None:
+                stdout.write(f'{function.__name__}: {done} из {total}')
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+def generate(recipes, seed=0, batch_size=1000, processes=1, use_copy=False,
+             stdout=None):
+    """Создает набор из recipes рецептов и пропорциональных им связей."""
+    prefix = f'synthetic{seed}'
+    if User.objects.filter(username__startswith=f'{prefix}_').exists():
+        raise FixturesExistError(f'Набор {prefix} уже создан')
+    if not Ingredient.objects.exists():
+        call_command('load_ingredients', CATALOG_PATH, stdout=stdout)
+    plan = Plan(seed, max(recipes // RECIPES_PER_USER, 2), recipes,
+                batch_size, use_copy)
+    plan.ingredients = list(
+        Ingredient.objects.order_by('id').values_list('id', 'name'))
+    generate_users(plan)
+    plan.tag_ids = list(Tag.objects.filter(
+        slug__startswith=f'{prefix}-tag-'
+    ).order_by('id').values_list('id', flat=True))
+    if stdout is not None:
+        stdout.write(f'Пользователей: {plan.users}, рецептов: {recipes}')
+    run_chunks(generate_recipes, plan, recipes, processes, stdout)
+    # Id заданы явно, последовательности нужно сдвинуть за них.
+    with connection.cursor() as cursor:
+        for statement in connection.ops.sequence_reset_sql(
+            no_style(), [User, Recipe]
+        ):
+            cursor.execute(statement)
+    run_chunks(generate_links, plan, plan.users, processes, stdout)
+    call_command('reconcile_counters', stdout=stdout)
+    call_command('rebuild_shopping_cart', batch_size=batch_size, stdout=stdout)
+    # Связи созданы только у новых пользователей, их данные еще не
+    # кэшировались, поэтому достаточно общих версий.
+    versions.bump(versions.CATALOG, versions.RECIPES, versions.FEED)
+    return prefix
@@ -0,0 +1,129 @@
+"""Обработка изображений рецептов.
+
+Base64 из запроса декодируется по частям во временный файл, у изображения
+проверяется только заголовок. Уменьшенные копии (RENDITIONS) строятся
+после фиксации транзакции в пуле потоков, а до их готовности вместо них
+отдается оригинал.
+"""
+import base64
+import binascii
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.db import connections, transaction
+from django.utils import timezone
+from foodgram.settings import (IMAGE_MAX_DIMENSION, IMAGE_MAX_SIZE,
+                               IMAGE_RENDITIONS, IMAGE_WORKERS)
+from PIL import Image, ImageOps
+from recipes import versions
+
+RENDITIONS = tuple(IMAGE_RENDITIONS)
+RENDITIONS_DIR = 'recipes/renditions'
+DECODE_CHUNK = 4 * 64 * 1024
+
+logger = logging.getLogger(__name__)
+_executor = None
+
+
+def decode_base64(encoded, name, content_type):
+    """Декодирует base64 частями во временный файл на диске."""
+    if len(encoded) // 4 * 3 > IMAGE_MAX_SIZE:
+        raise ValueError(
+            f'Размер изображения больше {IMAGE_MAX_SIZE // 1024 // 1024} МБ')
+    file = TemporaryUploadedFile(name, content_type, 0, None)
+    try:
+        for start in range(0, len(encoded), DECODE_CHUNK):
+            file.write(base64.b64decode(
+                encoded[start:start + DECODE_CHUNK]))
+    except binascii.Error:
+        file.close()
+        raise ValueError('Некорректные данные base64')
+    file.size = file.tell()
+    file.seek(0)
+    return file
+
+
+def check_dimensions(file):
+    """Проверяет размеры по заголовку, не декодируя пиксели."""
+    try:
+        with Image.open(file) as image:
+            width, height = image.size
+    except (OSError, Image.DecompressionBombError):
+        raise ValueError('Загрузите корректное изображение')
+    finally:
+        file.seek(0)
+    if max(width, height) > IMAGE_MAX_DIMENSION:
+        raise ValueError(
+            f'Размер изображения больше {IMAGE_MAX_DIMENSION} точек')
+
+
+def rendition_name(name, rendition):
+    stem = os.path.basename(name).replace('.', '_')
+    return f'{RENDITIONS_DIR}/{rendition}/{stem}.jpg'
+
+
+def rendition_url(image, rendition, ready):
+    """Адрес уменьшенной копии или оригинала, если копия еще не готова."""
+    if not image:
+        return None
+    if not ready:
+        return image.url
+    return default_storage.url(rendition_name(image.name, rendition))
+
+
+def build_renditions(recipe_id, name, force=False):
+    """Строит уменьшенные копии, от большей к меньшей.
+
+    Имена копий выводятся из имени оригинала, поэтому для уже
+    обработанного содержимого копии повторно не строятся.
+    """
+    from recipes.models import Recipe
+
+    paths = {
+        rendition: rendition_name(name, rendition) for rendition in RENDITIONS
+    }
+    if force or not all(map(default_storage.exists, paths.values())):
+        storage = Recipe._meta.get_field('image').storage
+        sizes = sorted(IMAGE_RENDITIONS.items(), key=lambda item: -item[1])
+        with storage.open(name) as file, Image.open(file) as image:
+            image.draft('RGB', (sizes[0][1], sizes[0][1]))
+            current = ImageOps.exif_transpose(image).convert('RGB')
+        for rendition, size in sizes:
+            current.thumbnail((size, size), Image.LANCZOS)
+            buffer = io.BytesIO()
+            current.save(buffer, 'JPEG', quality=85, optimize=True)
+            default_storage.delete(paths[rendition])
+            default_storage.save(
+                paths[rendition], ContentFile(buffer.getvalue()))
+    if Recipe.objects.filter(pk=recipe_id, image=name).update(
+        renditions_ready=True, updated_at=timezone.now()
+    ):
+        versions.bump(versions.RECIPES)
+        versions.touch(versions.recipe_key(recipe_id))
+
+
+def run(recipe_id, name):
+    try:
+        build_renditions(recipe_id, name)
+    except Exception:
+        logger.exception('Не удалось обработать изображение %s', name)
+    finally:
+        if IMAGE_WORKERS:
+            connections.close_all()
+
+
+def schedule(recipe_id, name):
+    """Ставит построение копий в очередь после фиксации транзакции."""
+    global _executor
+    if not IMAGE_WORKERS:
+        transaction.on_commit(lambda: run(recipe_id, name))
+        return
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=IMAGE_WORKERS, thread_name_prefix='renditions')
+    transaction.on_commit(lambda: _executor.submit(run, recipe_id, name))
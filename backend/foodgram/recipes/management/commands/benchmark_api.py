@@ -0,0 +1,352 @@
+import base64
+import io
+import json
+import platform
+import time
+import tracemalloc
+from collections import defaultdict
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from recipes import fixtures
+from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
+                            ShoppingList, Tag)
+from rest_framework.authtoken.models import Token
+from users.models import Subscription, User
+
+COUNTED_MODELS = (User, Tag, Ingredient, Recipe, IngredientRecipe,
+                  Favorite, ShoppingList, Subscription)
+PERCENTILES = (50, 95, 99)
+CREATED_USERS = 'benchmark'
+
+
+def percentile(values, percent):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, len(ordered) * percent // 100)]
+
+
+def image_payload():
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 64), '#C0FFEE').save(buffer, 'PNG')
+    return 'data:image/png;base64,' + base64.b64encode(
+        buffer.getvalue()).decode()
+
+
+class Dataset:
+    """Объекты синтетического набора, к которым обращаются сценарии."""
+
+    def __init__(self, prefix, size):
+        self.user = User.objects.get(username=f'{prefix}_0')
+        self.other = User.objects.get(username=f'{prefix}_1')
+        self.recipe = Recipe.objects.filter(author__username__startswith=(
+            f'{prefix}_')).order_by('id').first()
+        self.tag = Tag.objects.filter(
+            slug__startswith=f'{prefix}-tag-').order_by('id').first()
+        self.ingredient_ids = list(IngredientRecipe.objects.filter(
+            recipe=self.recipe).values_list('ingredient_id', flat=True))
+        self.free_recipes = list(Recipe.objects.exclude(
+            is_favorited__user=self.user
+        ).exclude(
+            is_in_shopping_list__user=self.user
+        ).order_by('-id').values_list('id', flat=True)[:size * 2])
+        self.free_authors = list(User.objects.filter(
+            username__startswith=f'{prefix}_'
+        ).exclude(
+            is_subscribed__subscriber=self.user
+        ).exclude(pk=self.user.pk).order_by('-id').values_list(
+            'id', flat=True)[:size * 2])
+        if len(self.free_recipes) < 2 or len(self.free_authors) < 2:
+            raise CommandError('В наборе мало рецептов или авторов')
+        self.image = image_payload()
+
+    def free_recipe(self, number):
+        return self.free_recipes[number % len(self.free_recipes)]
+
+    def free_author(self, number):
+        return self.free_authors[number % len(self.free_authors)]
+
+
+def users(data, number):
+    yield 'users', 'get', '/api/users/?limit=6', None
+    yield 'users cursor', 'get', '/api/users/?pagination=cursor&limit=6', None
+    yield 'user', 'get', f'/api/users/{data.other.pk}/', None
+    yield 'me', 'get', '/api/users/me/', None
+    yield ('subscriptions', 'get',
+           '/api/users/subscriptions/?limit=6&recipes_limit=3', None)
+    yield 'set password', 'post', '/api/users/set_password/', {
+        'current_password': fixtures.PASSWORD,
+        'new_password': fixtures.PASSWORD}
+
+
+def signup(data, number):
+    yield 'signup', 'post', '/api/users/', {
+        'email': f'{CREATED_USERS}_{number}@example.com',
+        'username': f'{CREATED_USERS}_{number}',
+        'first_name': 'Имя', 'last_name': 'Фамилия',
+        'password': fixtures.PASSWORD}, ''
+    response = yield 'login', 'post', '/api/auth/token/login/', {
+        'email': f'{CREATED_USERS}_{number}@example.com',
+        'password': fixtures.PASSWORD}, ''
+    yield ('logout', 'post', '/api/auth/token/logout/', None,
+           json.loads(response.content)['auth_token'])
+
+
+def subscribe(data, number):
+    author = data.free_author(number)
+    yield 'subscribe', 'post', f'/api/users/{author}/subscribe/', None
+    yield 'unsubscribe', 'delete', f'/api/users/{author}/subscribe/', None
+    authors = [data.free_author(number + 1), author]
+    yield 'subscribe bulk', 'post', '/api/users/subscribe/bulk/', {
+        'add': authors}
+    yield 'subscribe bulk', 'post', '/api/users/subscribe/bulk/', {
+        'remove': authors}
+
+
+def catalog(data, number):
+    yield 'tags', 'get', '/api/tags/', None
+    yield 'tag', 'get', f'/api/tags/{data.tag.pk}/', None
+    yield 'ingredients', 'get', '/api/ingredients/?name=сол', None
+    yield ('ingredient', 'get',
+           f'/api/ingredients/{data.ingredient_ids[0]}/', None)
+
+
+def feed(data, number):
+    yield 'recipes', 'get', '/api/recipes/?limit=6', None
+    yield ('recipes cursor', 'get',
+           '/api/recipes/?pagination=cursor&limit=6', None)
+    yield ('recipes by tag', 'get',
+           f'/api/recipes/?limit=6&tags={data.tag.slug}', None)
+    yield ('recipes by author', 'get',
+           f'/api/recipes/?limit=6&author={data.recipe.author_id}', None)
+    yield ('recipes favorited', 'get',
+           '/api/recipes/?limit=6&is_favorited=1', None)
+    yield ('recipes in cart', 'get',
+           '/api/recipes/?limit=6&is_in_shopping_cart=1', None)
+    yield 'recipes search', 'get', '/api/recipes/?limit=6&search=суп', None
+    yield 'recipe', 'get', f'/api/recipes/{data.recipe.pk}/', None
+    ingredients = '&'.join(
+        f'ingredients={pk}' for pk in data.ingredient_ids)
+    yield ('what can i cook', 'get',
+           f'/api/recipes/what_can_i_cook/?{ingredients}&limit=6', None)
+    yield ('download shopping cart', 'get',
+           '/api/recipes/download_shopping_cart/', None)
+
+
+def anonymous_feed(data, number):
+    yield 'recipes anonymous', 'get', '/api/recipes/?limit=6', None, ''
+    yield ('recipe anonymous', 'get',
+           f'/api/recipes/{data.recipe.pk}/', None, '')
+
+
+def recipe_write(data, number):
+    recipe = {
+        'name': f'{CREATED_USERS} {number}', 'text': 'Описание',
+        'cooking_time': 10, 'tags': [data.tag.pk],
+        'ingredients': [
+            {'id': pk, 'amount': 10} for pk in data.ingredient_ids]}
+    response = yield 'recipe create', 'post', '/api/recipes/', dict(
+        recipe, image=data.image)
+    pk = json.loads(response.content)['id']
+    yield 'recipe update', 'patch', f'/api/recipes/{pk}/', dict(
+        recipe, cooking_time=20)
+    yield 'recipe delete', 'delete', f'/api/recipes/{pk}/', None
+
+
+def links(data, number):
+    recipe = data.free_recipe(number)
+    for name, path in (('favorite', 'favorite'),
+                       ('shopping cart', 'shopping_cart')):
+        url = f'/api/recipes/{recipe}/{path}/'
+        yield f'{name} add', 'post', url, None
+        yield f'{name} remove', 'delete', url, None
+        recipes = [data.free_recipe(number + 1), recipe]
+        bulk_url = f'/api/recipes/{path}/bulk/'
+        yield f'{name} bulk', 'post', bulk_url, {'add': recipes}
+        yield f'{name} bulk', 'post', bulk_url, {'remove': recipes}
+
+
+SCENARIOS = (users, signup, subscribe, catalog, feed, anonymous_feed,
+             recipe_write, links)
+
+
+class Command(BaseCommand):
+    help = ('Замеряет время ответа, число запросов к базе и пиковую '
+            'память для маршрутов API на синтетическом наборе данных '
+            'и сохраняет отчет в JSON для сравнения между коммитами.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scale',
+            choices=fixtures.SCALES,
+            help='Создать набор данных такого размера, если его еще нет'
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='Номер синтетического набора'
+        )
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=20,
+            help='Сколько раз выполнить каждый сценарий'
+        )
+        parser.add_argument(
+            '--warmup',
+            type=int,
+            default=1,
+            help='Сколько первых прогонов не учитывать'
+        )
+        parser.add_argument(
+            '--output',
+            help='Файл для отчета в JSON, по умолчанию вывод в консоль'
+        )
+        parser.add_argument(
+            '--baseline',
+            help='Отчет предыдущего запуска для сравнения'
+        )
+
+    def handle(self, *args, **options):
+        if options['scale']:
+            try:
+                fixtures.generate(
+                    fixtures.SCALES[options['scale']],
+                    seed=options['seed'], stdout=self.stdout)
+            except fixtures.FixturesExistError as error:
+                self.stdout.write(f'{error}, используется существующий')
+        prefix = f'synthetic{options["seed"]}'
+        if not User.objects.filter(username=f'{prefix}_0').exists():
+            raise CommandError(
+                f'Набора {prefix} нет в базе, укажите --scale')
+        data = Dataset(prefix, options['warmup'] + options['iterations'] + 1)
+        token = Token.objects.get_or_create(user=data.user)[0].key
+        samples = defaultdict(list)
+        User.objects.filter(username__startswith=f'{CREATED_USERS}_').delete()
+        try:
+            for scenario in SCENARIOS:
+                self.run(scenario, data, token, samples, options)
+        finally:
+            User.objects.filter(
+                username__startswith=f'{CREATED_USERS}_').delete()
+        report = {
+            'meta': {
+                'database': connection.vendor,
+                'django': django.get_version(),
+                'python': platform.python_version(),
+                'iterations': options['iterations'],
+                'rows': {
+                    model._meta.label: model.objects.count()
+                    for model in COUNTED_MODELS},
+            },
+            'routes': {
+                route: self.summarize(route_samples)
+                for route, route_samples in samples.items()},
+        }
+        content = json.dumps(report, indent=2, sort_keys=True,
+                             ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(content + '\n')
+            self.print_table(report, options['baseline'])
+        else:
+            self.stdout.write(content)
+
+    def run(self, scenario, data, token, samples, options):
+        runs = options['warmup'] + options['iterations'] + 1
+        for number in range(runs):
+            # Последний прогон только для замера памяти: трассировка
+            # tracemalloc замедляет код и искажает время.
+            traced = number == runs - 1
+            recorded = number >= options['warmup']
+            steps = scenario(data, number)
+            response = None
+            while True:
+                try:
+                    step = steps.send(response)
+                except StopIteration:
+                    break
+                name, method, url, payload, *step_token = step
+                step_token = step_token[0] if step_token else token
+                response, sample = self.request(
+                    method, url, payload, step_token, traced)
+                route = f'{method.upper()} {name}'
+                if not recorded:
+                    continue
+                if traced:
+                    samples[route].append({'memory': sample['memory']})
+                else:
+                    samples[route].append(sample)
+
+    def request(self, method, url, payload, token, traced):
+        headers = {'HTTP_AUTHORIZATION': f'Token {token}'} if token else {}
+        client = Client(**headers)
+        kwargs = {}
+        if method != 'get':
+            kwargs['content_type'] = 'application/json'
+            kwargs['data'] = json.dumps(payload) if payload else ''
+        if traced:
+            tracemalloc.start()
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = getattr(client, method)(url, **kwargs)
+            if response.streaming:
+                for _ in response.streaming_content:
+                    pass
+            elapsed = time.perf_counter() - started
+        memory = None
+        if traced:
+            memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        if response.status_code >= 400:
+            self.stderr.write(
+                f'{method.upper()} {url}: {response.status_code} '
+                f'{response.content[:200]!r}')
+        return response, {
+            'time': elapsed,
+            'queries': len(queries.captured_queries),
+            'error': response.status_code >= 400,
+            'memory': memory,
+        }
+
+    def summarize(self, samples):
+        timed = [sample for sample in samples if 'time' in sample]
+        times = [sample['time'] * 1000 for sample in timed]
+        summary = {
+            f'p{percent}_ms': round(percentile(times, percent), 2)
+            for percent in PERCENTILES
+        }
+        summary.update(
+            requests=len(timed),
+            errors=sum(sample['error'] for sample in timed),
+            max_ms=round(max(times), 2),
+            queries=max(sample['queries'] for sample in timed),
+            memory_kb=max(
+                (sample['memory'] // 1024 for sample in samples
+                 if sample['memory'] is not None), default=None),
+        )
+        return summary
+
+    def print_table(self, report, baseline_path):
+        baseline = {}
+        if baseline_path:
+            with open(baseline_path, encoding='utf-8') as file:
+                baseline = json.load(file)['routes']
+        for route, summary in sorted(report['routes'].items()):
+            line = (f'{route:<32} p50 {summary["p50_ms"]:>8.2f} мс  '
+                    f'p95 {summary["p95_ms"]:>8.2f} мс  '
+                    f'запросов {summary["queries"]:>3}  '
+                    f'память {summary["memory_kb"]} КБ')
+            previous = baseline.get(route)
+            if previous:
+                line += (
+                    f'  | p95 {summary["p95_ms"] - previous["p95_ms"]:+.2f}'
+                    f' мс, запросов '
+                    f'{summary["queries"] - previous["queries"]:+d}')
+            if summary['errors']:
+                line = self.style.ERROR(f'{line}  ошибок {summary["errors"]}')
+            self.stdout.write(line)
@@ -0,0 +1,73 @@
+import os
+import random
+import tempfile
+import time
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.management.base import BaseCommand
+from recipes.storage import ContentAddressedStorage
+
+
+def disk_usage(root):
+    files = size = 0
+    for directory, _, names in os.walk(root):
+        for name in names:
+            files += 1
+            size += os.path.getsize(os.path.join(directory, name))
+    return files, size
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает обычное и адресуемое по содержимому хранилище '
+            'изображений: занятое место и время записи.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--uploads',
+            type=int,
+            default=500,
+            help='Количество загрузок'
+        )
+        parser.add_argument(
+            '--unique',
+            type=int,
+            default=100,
+            help='Количество разных изображений среди загрузок'
+        )
+        parser.add_argument(
+            '--size',
+            type=int,
+            default=512,
+            help='Размер одного изображения, КБ'
+        )
+
+    def handle(self, *args, **options):
+        randomizer = random.Random(0)
+        payloads = [
+            os.urandom(options['size'] * 1024)
+            for _ in range(options['unique'])
+        ]
+        uploads = [
+            randomizer.choice(payloads) for _ in range(options['uploads'])
+        ]
+        self.stdout.write(
+            f'Загрузок: {len(uploads)}, разных изображений: '
+            f'{len(payloads)}, размер: {options["size"]} КБ')
+        for storage_class in (FileSystemStorage, ContentAddressedStorage):
+            with tempfile.TemporaryDirectory() as root:
+                storage = storage_class(location=root)
+                timings = []
+                for payload in uploads:
+                    started = time.perf_counter()
+                    storage.save(
+                        'recipes/images/image.jpg', ContentFile(payload))
+                    timings.append(time.perf_counter() - started)
+                files, size = disk_usage(root)
+            timings.sort()
+            self.stdout.write(
+                f'{storage_class.__name__}: файлов {files}, '
+                f'{size / 1024 / 1024:.1f} МБ, запись: '
+                f'среднее {sum(timings) / len(timings) * 1000:.2f} мс, '
+                f'p95 {timings[int(len(timings) * 0.95)] * 1000:.2f} мс'
+            )
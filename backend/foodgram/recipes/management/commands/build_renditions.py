@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from recipes.images import build_renditions
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = ('Строит уменьшенные копии изображений рецептов, для которых '
+            'они еще не готовы.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Перестроить копии для всех рецептов'
+        )
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='')
+        if not options['all']:
+            recipes = recipes.filter(renditions_ready=False)
+        built = failed = 0
+        for recipe_id, name in recipes.values_list(
+            'id', 'image'
+        ).iterator():
+            try:
+                build_renditions(recipe_id, name, force=options['all'])
+            except OSError as error:
+                failed += 1
+                self.stderr.write(f'{name}: {error}')
+                continue
+            built += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано изображений: {built}, с ошибками: {failed}'))
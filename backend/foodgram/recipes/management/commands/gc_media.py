@@ -0,0 +1,67 @@
+import posixpath
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from recipes.images import RENDITIONS, RENDITIONS_DIR, rendition_name
+from recipes.models import Recipe
+
+IMAGES_DIR = Recipe._meta.get_field('image').upload_to.rstrip('/')
+
+
+def walk(storage, directory):
+    if not storage.exists(directory):
+        return
+    directories, files = storage.listdir(directory)
+    for name in files:
+        yield posixpath.join(directory, name)
+    for name in directories:
+        yield from walk(storage, posixpath.join(directory, name))
+
+
+class Command(BaseCommand):
+    help = ('Удаляет изображения рецептов и их уменьшенные копии, '
+            'на которые больше не ссылается ни один рецепт.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-age',
+            type=int,
+            default=60,
+            help='Не удалять файлы моложе указанного числа минут'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать, что будет удалено'
+        )
+
+    def handle(self, *args, **options):
+        storage = default_storage
+        referenced = set()
+        for name in Recipe.objects.exclude(image='').values_list(
+            'image', flat=True
+        ).iterator():
+            referenced.add(name)
+            referenced.update(
+                rendition_name(name, rendition) for rendition in RENDITIONS)
+        # Файл, записанный до фиксации транзакции с рецептом, еще не
+        # упомянут в базе, поэтому свежие файлы не трогаем.
+        threshold = timezone.now() - timedelta(minutes=options['min_age'])
+        removed = freed = 0
+        for directory in (IMAGES_DIR, RENDITIONS_DIR):
+            for name in walk(storage, directory):
+                if (name in referenced
+                        or storage.get_modified_time(name) > threshold):
+                    continue
+                removed += 1
+                freed += storage.size(name)
+                if options['dry_run']:
+                    self.stdout.write(name)
+                else:
+                    storage.delete(name)
+        action = 'Будет удалено' if options['dry_run'] else 'Удалено'
+        self.stdout.write(self.style.SUCCESS(
+            f'{action} файлов: {removed}, '
+            f'{freed / 1024 / 1024:.2f} МБ'))
@@ -0,0 +1,65 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from recipes import fixtures
+
+
+class Command(BaseCommand):
+    help = ('Создает синтетический набор пользователей, рецептов, '
+            'избранного, подписок и списков покупок для замеров '
+            'на объемах, близких к боевым.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--recipes',
+            type=int,
+            default=fixtures.SCALES['10k'],
+            help='Количество рецептов, пользователей в 10 раз меньше'
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='Номер набора: одинаковый seed дает одинаковые данные'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Размер пачки для bulk_create'
+        )
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=1,
+            help='Число процессов записи (PostgreSQL)'
+        )
+        parser.add_argument(
+            '--copy',
+            action='store_true',
+            help='Загружать через COPY (PostgreSQL)'
+        )
+
+    def handle(self, *args, **options):
+        is_postgresql = connection.vendor == 'postgresql'
+        if options['copy'] and not is_postgresql:
+            raise CommandError('COPY поддерживается только в PostgreSQL')
+        if options['processes'] > 1 and not is_postgresql:
+            raise CommandError(
+                'Запись в несколько процессов поддерживается только '
+                'в PostgreSQL')
+        started = time.monotonic()
+        try:
+            prefix = fixtures.generate(
+                options['recipes'],
+                seed=options['seed'],
+                batch_size=options['batch_size'],
+                processes=options['processes'],
+                use_copy=options['copy'],
+                stdout=self.stdout
+            )
+        except fixtures.FixturesExistError as error:
+            raise CommandError(str(error))
+        self.stdout.write(self.style.SUCCESS(
+            f'Набор {prefix} создан за {time.monotonic() - started:.1f} с'))
@@ -1,27 +1,179 @@
+import csv
+import io
 import json
+import os
+import time
+from itertools import islice
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from recipes import catalog
 from recipes.models import Ingredient
 
+DATA_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+DEFAULT_PATH = os.path.join(DATA_DIR, 'ingredients.json')
+FORMATS = ('csv', 'json')
+CHUNK_SIZE = 64 * 1024
+
+
+def iter_csv(file):
+    for row in csv.reader(file):
+        if len(row) >= 2:
+            yield row[0].strip(), row[1].strip()
+
+
+def iter_json(file):
+    """Потоково разбирает JSON-массив объектов, не читая файл целиком."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    started = False
+    for chunk in iter(lambda: file.read(CHUNK_SIZE), ''):
+        buffer += chunk
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if not started and position < len(buffer):
+                if buffer[position] != '[':
+                    raise CommandError('Ожидается JSON-массив ингредиентов')
+                started = True
+                position += 1
+                continue
+            if position >= len(buffer) or buffer[position] == ']':
+                break
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                break
+            yield item['name'].strip(), item['measurement_unit'].strip()
+        buffer = buffer[position:]
+    if buffer.strip() not in ('', ']'):
+        raise CommandError('Некорректный JSON в конце файла')
+
+
+class CSVStream:
+    """Файлоподобный объект для COPY, отдающий строки по мере чтения."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.total = 0
+
+    def read(self, size=-1):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in self.rows:
+            writer.writerow(row)
+            self.total += 1
+            if size >= 0 and buffer.tell() >= size:
+                break
+        return buffer.getvalue()
+
 
 class Command(BaseCommand):
+    help = 'Загружает справочник ингредиентов из CSV или JSON файла.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            nargs='?',
+            default=DEFAULT_PATH,
+            help='Путь к файлу с ингредиентами'
+        )
+        parser.add_argument(
+            '--format',
+            choices=FORMATS,
+            help='Формат файла, по умолчанию определяется по расширению'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Количество строк в одной пачке'
+        )
+        parser.add_argument(
+            '--copy',
+            action='store_true',
+            help='Загружать через COPY во временную таблицу (PostgreSQL)'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только разобрать файл, ничего не записывая в базу'
+        )
+
     def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or os.path.splitext(
+            path)[1].lstrip('.').lower()
+        if file_format not in FORMATS:
+            raise CommandError(f'Неизвестный формат файла: {file_format}')
+        if options['copy'] and connection.vendor != 'postgresql':
+            raise CommandError('COPY поддерживается только в PostgreSQL')
+        parse = iter_csv if file_format == 'csv' else iter_json
+        started = time.monotonic()
+        before = Ingredient.objects.count()
+        try:
+            with open(path, 'r', encoding='utf-8', newline='') as file:
+                rows = parse(file)
+                if options['dry_run']:
+                    total = sum(1 for _ in rows)
+                elif options['copy']:
+                    total = self.load_copy(rows)
+                else:
+                    total = self.load_batches(rows, options['batch_size'])
+        except OSError as error:
+            raise CommandError(f'Не удалось открыть файл: {error}')
+        elapsed = time.monotonic() - started
+        summary = (f'время: {elapsed:.2f} с, '
+                   f'{total / elapsed if elapsed else total:.0f} строк/с')
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(
+                f'Строк в файле: {total}, запись не выполнялась, {summary}'))
+            return
+        inserted = Ingredient.objects.count() - before
+        self.stdout.write(self.style.SUCCESS(
+            f'Строк в файле: {total}, добавлено: {inserted}, '
+            f'пропущено дубликатов: {total - inserted}, {summary}'
+        ))
+
+    def load_batches(self, rows, batch_size):
+        total = 0
+        with transaction.atomic():
+            while True:
+                batch = [
+                    Ingredient(name=name, measurement_unit=measurement_unit)
+                    for name, measurement_unit in islice(rows, batch_size)
+                ]
+                if not batch:
+                    break
+                Ingredient.objects.bulk_create(
+                    batch, ignore_conflicts=True)
+                total += len(batch)
+                self.stdout.write(f'Обработано строк: {total}')
+            transaction.on_commit(catalog.invalidate)
+        return total
 
-        with open('recipes/management/data/ingredients.json',
-                  'r',
-                  encoding="utf-8") as file:
-            data = json.load(file)
-            print('Файл успешно загружен')
-
-            for i in data:
-                print('Начало записи в базу...')
-                ingredient = Ingredient()
-                ingredient.name = i['name']
-                ingredient.measurement_unit = i['measurement_unit']
-                try:
-                    ingredient.save()
-                    print(f'{ingredient} записан в базу успешно...')
-                except Exception as error:
-                    print(f'{error}! {ingredient.name} с единицей измерения '
-                          f'{ingredient.measurement_unit} уже есть в базе')
-        print('Все данные импортированы успешно!')
+    def load_copy(self, rows):
+        stream = CSVStream(rows)
+        table = Ingredient._meta.db_table
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMP TABLE ingredient_staging '
+                '(name varchar(200), measurement_unit varchar(200)) '
+                'ON COMMIT DROP'
+            )
+            cursor.copy_expert(
+                'COPY ingredient_staging (name, measurement_unit) '
+                'FROM STDIN WITH (FORMAT csv)',
+                stream
+            )
+            cursor.execute(
+                f'INSERT INTO {table} (name, measurement_unit) '
+                'SELECT DISTINCT name, measurement_unit '
+                'FROM ingredient_staging '
+                'ON CONFLICT (name, measurement_unit) DO NOTHING'
+            )
+            self.stdout.write(f'Обработано строк: {stream.total}')
+            transaction.on_commit(catalog.invalidate)
+        return stream.total
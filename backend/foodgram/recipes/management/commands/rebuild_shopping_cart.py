@@ -0,0 +1,65 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Sum
+from recipes.models import IngredientRecipe, ShoppingCartItem
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает агрегированные списки покупок пользователей.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Только сверить агрегаты, ничего не записывая'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Размер пачки при записи в базу'
+        )
+
+    def handle(self, *args, **options):
+        expected = {
+            (row['recipe__is_in_shopping_list__user'], row['ingredient']):
+                row['total_amount']
+            for row in IngredientRecipe.objects.filter(
+                recipe__is_in_shopping_list__isnull=False
+            ).values(
+                'recipe__is_in_shopping_list__user', 'ingredient'
+            ).annotate(total_amount=Sum('amount')).order_by().iterator()
+        }
+        stored = {
+            (user_id, ingredient_id): total_amount
+            for user_id, ingredient_id, total_amount
+            in ShoppingCartItem.objects.values_list(
+                'user_id', 'ingredient_id', 'total_amount').iterator()
+        }
+        mismatched = {
+            key for key in expected.keys() | stored.keys()
+            if expected.get(key) != stored.get(key)
+        }
+        self.stdout.write(
+            f'Строк в списках покупок: {len(expected)}, '
+            f'расхождений: {len(mismatched)}'
+        )
+        if options['verify']:
+            if mismatched:
+                raise CommandError(
+                    'Агрегаты списков покупок не совпадают с рецептами')
+            self.stdout.write(self.style.SUCCESS(
+                'Агрегаты списков покупок актуальны'))
+            return
+        with transaction.atomic():
+            ShoppingCartItem.objects.all().delete()
+            ShoppingCartItem.objects.bulk_create(
+                (ShoppingCartItem(user_id=user_id,
+                                  ingredient_id=ingredient_id,
+                                  total_amount=total_amount)
+                 for (user_id, ingredient_id), total_amount
+                 in expected.items()),
+                batch_size=options['batch_size']
+            )
+        self.stdout.write(self.style.SUCCESS(
+            'Агрегаты списков покупок пересчитаны'))
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+from recipes.models import Favorite, Recipe
+from users.models import Subscription, User, count_related
+
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'subscribers_count', Subscription, 'author'),
+)
+
+
+class Command(BaseCommand):
+    help = ('Сверяет денормализованные счетчики избранного, рецептов '
+            'и подписчиков с данными и исправляет расхождения.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Только сверить счетчики, ничего не записывая'
+        )
+
+    def handle(self, *args, **options):
+        mismatched = 0
+        with transaction.atomic():
+            for model, field, related_model, related_field in COUNTERS:
+                actual = count_related(related_model, related_field)
+                stale = model._default_manager.annotate(
+                    actual=actual
+                ).exclude(**{field: F('actual')}).values('pk')
+                count = stale.count()
+                mismatched += count
+                self.stdout.write(
+                    f'{model._meta.verbose_name_plural}.{field}: '
+                    f'расхождений: {count}'
+                )
+                if count and not options['verify']:
+                    model.recount_counter(
+                        stale, field, related_model, related_field)
+        if options['verify']:
+            if mismatched:
+                raise CommandError('Счетчики не совпадают с данными')
+            self.stdout.write(self.style.SUCCESS('Счетчики актуальны'))
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f'Исправлено счетчиков: {mismatched}'))
@@ -0,0 +1,312 @@
+"""Подбор рецептов по имеющимся у пользователя ингредиентам.
+
+Каждый процесс держит в памяти отсортированный массив id ингредиентов
+каждого рецепта и обратный индекс ингредиент -> рецепты. При смене версии
+рецептов индекс дочитывает только рецепты, измененные с прошлого
+обновления (по updated_at), и убирает удаленные по журналу удалений, а раз
+в MATCHING_REBUILD_INTERVAL секунд перестраивается целиком. Запрос к
+индексу не обращается к базе.
+"""
+import heapq
+import re
+import time
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+from datetime import timedelta
+from threading import Lock
+
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+from foodgram.settings import MATCHING_REBUILD_INTERVAL
+from recipes import versions
+
+# Запас на транзакции, зафиксированные позже, чем был выставлен updated_at.
+REFRESH_LAG = timedelta(minutes=1)
+# Журнал удаленных рецептов: пары (время удаления, id рецепта). Записи
+# старше интервала перестройки не нужны ни одному индексу.
+DELETED_KEY = 'recipes:matching:deleted'
+DELETED_TIMEOUT = MATCHING_REBUILD_INTERVAL + REFRESH_LAG.total_seconds()
+# Битовая маска занимает число рецептов / 8 байт, массив - 8 байт на
+# рецепт: маска выгоднее, если ингредиент есть больше чем в 1/64 рецептов.
+BITSET_RATIO = 64
+NONZERO_BYTE = re.compile(b'[^\x00]')
+
+
+def contains(ingredients, ingredient_id):
+    position = bisect_left(ingredients, ingredient_id)
+    return (position < len(ingredients)
+            and ingredients[position] == ingredient_id)
+
+
+def bits_to_int(positions, size):
+    bits = bytearray((size + 7) // 8)
+    for position in positions:
+        bits[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(bits, 'little')
+
+
+def iter_bits(value):
+    """Номера единичных битов по убыванию."""
+    data = value.to_bytes((value.bit_length() + 7) // 8, 'big')
+    last = len(data) - 1
+    for found in NONZERO_BYTE.finditer(data):
+        byte = data[found.start()]
+        offset = (last - found.start()) * 8
+        for bit in range(7, -1, -1):
+            if byte >> bit & 1:
+                yield offset + bit
+
+
+def count_bits(bitsets):
+    """Поразрядные счетчики единиц в масках.
+
+    i-я маска результата - позиции, у которых в числе единиц на этой
+    позиции установлен i-й бит.
+    """
+    planes = []
+    for carry in bitsets:
+        for bit, plane in enumerate(planes):
+            planes[bit], carry = plane ^ carry, plane & carry
+            if not carry:
+                break
+        if carry:
+            planes.append(carry)
+    return planes
+
+
+def log_deleted(recipe_ids):
+    """Дописывает рецепты в журнал удалений и меняет версию рецептов.
+
+    Версия меняется после записи в журнал, чтобы индекс, увидевший новую
+    версию, увидел и запись. Чтение и запись журнала не атомарны: рецепт,
+    потерянный при гонке, уберет what_can_i_cook, не найдя его в базе.
+    """
+    store = caches['versions']
+    now = time.time()
+    deleted = [
+        entry for entry in store.get(DELETED_KEY, [])
+        if entry[0] > now - DELETED_TIMEOUT
+    ]
+    deleted.extend((now, recipe_id) for recipe_id in recipe_ids)
+    store.set(DELETED_KEY, deleted, None)
+    versions.bump(versions.RECIPES)
+
+
+def log_deleted_on_commit(*recipe_ids):
+    transaction.on_commit(lambda: log_deleted(recipe_ids))
+
+
+class MatchingIndex:
+    """Массивы ингредиентов рецептов и обратный индекс по ингредиентам.
+
+    Редкие ингредиенты хранят массив id рецептов, в который при изменении
+    рецепта только дописываются новые пары, поэтому покрытие найденных по
+    нему рецептов пересчитывается по точному массиву. Частые ингредиенты
+    хранят битовую маску позиций рецептов, как и группы рецептов по числу
+    ингредиентов: совпадения по ним считаются поразрядно сразу для всех
+    рецептов, без обхода длинных списков. Позиции выдаются по возрастанию
+    id рецептов, новые рецепты получают следующие.
+    """
+
+    def __init__(self, version):
+        self.version = version
+        self.ingredients = {}
+        self.positions = {}
+        self.recipe_ids = array('q')
+        self.postings = defaultdict(lambda: array('q'))
+        self.bitsets = {}
+        self.lengths = defaultdict(int)
+        self.built_at = self.synced_at = timezone.now()
+
+    @classmethod
+    def build(cls, version):
+        from recipes.models import IngredientRecipe
+
+        index = cls(version)
+        grouped = defaultdict(list)
+        for recipe_id, ingredient_id in IngredientRecipe.objects.values_list(
+            'recipe_id', 'ingredient_id'
+        ).iterator():
+            grouped[recipe_id].append(ingredient_id)
+        index.fill(grouped)
+        return index
+
+    def fill(self, grouped):
+        """Заполняет пустой индекс по словарю рецепт -> ингредиенты."""
+        members = defaultdict(list)
+        lengths = defaultdict(list)
+        for recipe_id in sorted(grouped):
+            ingredients = array('q', sorted(set(grouped[recipe_id])))
+            position = self.positions[recipe_id] = len(self.recipe_ids)
+            self.recipe_ids.append(recipe_id)
+            self.ingredients[recipe_id] = ingredients
+            lengths[len(ingredients)].append(position)
+            for ingredient_id in ingredients:
+                members[ingredient_id].append(position)
+        size = len(self.recipe_ids)
+        for ingredient_id, positions in members.items():
+            if len(positions) * BITSET_RATIO > size:
+                self.bitsets[ingredient_id] = bits_to_int(positions, size)
+            else:
+                self.postings[ingredient_id] = array(
+                    'q', [self.recipe_ids[item] for item in positions])
+        for length, positions in lengths.items():
+            self.lengths[length] = bits_to_int(positions, size)
+
+    def get_position(self, recipe_id):
+        if recipe_id not in self.positions:
+            self.positions[recipe_id] = len(self.recipe_ids)
+            self.recipe_ids.append(recipe_id)
+        return self.positions[recipe_id]
+
+    def set_recipe(self, recipe_id, ingredient_ids):
+        new = array('q', sorted(set(ingredient_ids)))
+        old = self.ingredients.get(recipe_id, array('q'))
+        if new == old:
+            return
+        if not new:
+            self.discard([recipe_id])
+            return
+        bit = 1 << self.get_position(recipe_id)
+        for ingredient_id in old:
+            if (ingredient_id in self.bitsets
+                    and not contains(new, ingredient_id)):
+                self.bitsets[ingredient_id] &= ~bit
+        for ingredient_id in new:
+            if contains(old, ingredient_id):
+                continue
+            if ingredient_id in self.bitsets:
+                self.bitsets[ingredient_id] |= bit
+            else:
+                self.postings[ingredient_id].append(recipe_id)
+        if len(new) != len(old):
+            if old:
+                self.lengths[len(old)] &= ~bit
+            self.lengths[len(new)] |= bit
+        self.ingredients[recipe_id] = new
+
+    def discard(self, recipe_ids):
+        for recipe_id in recipe_ids:
+            ingredients = self.ingredients.pop(recipe_id, None)
+            if ingredients is None:
+                continue
+            bit = 1 << self.positions.pop(recipe_id)
+            for ingredient_id in ingredients:
+                if ingredient_id in self.bitsets:
+                    self.bitsets[ingredient_id] &= ~bit
+            self.lengths[len(ingredients)] &= ~bit
+
+    def refresh(self, version):
+        from recipes.models import IngredientRecipe, Recipe
+
+        started = timezone.now()
+        since = self.synced_at - REFRESH_LAG
+        deleted = [
+            recipe_id for deleted_at, recipe_id
+            in caches['versions'].get(DELETED_KEY, [])
+            if deleted_at >= since.timestamp()
+        ]
+        changed = set(Recipe.objects.filter(
+            updated_at__gte=since).values_list('pk', flat=True))
+        grouped = {recipe_id: [] for recipe_id in changed}
+        for recipe_id, ingredient_id in IngredientRecipe.objects.filter(
+            recipe_id__in=changed
+        ).values_list('recipe_id', 'ingredient_id'):
+            grouped[recipe_id].append(ingredient_id)
+        for recipe_id, ingredient_ids in grouped.items():
+            self.set_recipe(recipe_id, ingredient_ids)
+        self.discard(deleted)
+        self.version = version
+        self.synced_at = started
+
+    def match(self, ingredient_ids, min_coverage=0, limit=None):
+        """Пары (id рецепта, покрытие) по убыванию покрытия.
+
+        Покрытие - доля ингредиентов рецепта, которые есть у пользователя.
+        """
+        have = set(ingredient_ids)
+        results = []
+        candidates = set()
+        for ingredient_id in have:
+            postings = self.postings.get(ingredient_id)
+            if postings:
+                candidates.update(postings)
+        for recipe_id in candidates:
+            ingredients = self.ingredients.get(recipe_id)
+            if not ingredients:
+                continue
+            count = len(have.intersection(ingredients))
+            coverage = count / len(ingredients)
+            if count and coverage >= min_coverage:
+                results.append((coverage, count, recipe_id))
+        groups = self.match_bitsets(
+            [self.bitsets[item] for item in have if item in self.bitsets],
+            bits_to_int(
+                [self.positions[recipe_id] for recipe_id in candidates
+                 if recipe_id in self.positions],
+                len(self.recipe_ids)
+            ),
+            min_coverage
+        )
+        # Группы идут по убыванию покрытия, а биты в группе - по убыванию
+        # id: дальше limit-го найденного рецепта читать не нужно.
+        found = 0
+        for coverage, count, matched in groups:
+            for position in iter_bits(matched):
+                if limit is not None and found >= limit:
+                    break
+                results.append((coverage, count, self.recipe_ids[position]))
+                found += 1
+        if limit is not None:
+            results = heapq.nlargest(limit, results)
+        else:
+            results.sort(reverse=True)
+        return [(recipe_id, coverage) for coverage, _, recipe_id in results]
+
+    def match_bitsets(self, bitsets, excluded, min_coverage):
+        """Группы рецептов, совпавших только по частым ингредиентам.
+
+        Возвращает тройки (покрытие, число совпадений, маска рецептов) по
+        убыванию покрытия.
+        """
+        planes = count_bits(bitsets)
+        groups = []
+        for length, members in list(self.lengths.items()):
+            members &= ~excluded
+            if not members:
+                continue
+            for count in range(min(length, len(bitsets)), 0, -1):
+                coverage = count / length
+                if coverage < min_coverage:
+                    break
+                if count.bit_length() > len(planes):
+                    continue
+                matched = members
+                for bit, plane in enumerate(planes):
+                    matched &= plane if count >> bit & 1 else ~plane
+                if matched:
+                    groups.append((coverage, count, matched))
+        groups.sort(key=lambda group: group[:2], reverse=True)
+        return groups
+
+
+_index = None
+_lock = Lock()
+
+
+def get_index():
+    global _index
+    version = versions.get_version(versions.RECIPES)
+    index = _index
+    if index is not None and index.version == version:
+        return index
+    with _lock:
+        if _index is None or timezone.now() - _index.built_at > timedelta(
+            seconds=MATCHING_REBUILD_INTERVAL
+        ):
+            _index = MatchingIndex.build(version)
+        elif _index.version != version:
+            _index.refresh(version)
+        return _index
@@ -0,0 +1,53 @@
+# Generated by Django 3.2.14 on 2026-10-18 17:59
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_shopping_cart_items(apps, schema_editor):
+    IngredientRecipe = apps.get_model('recipes', 'IngredientRecipe')
+    ShoppingCartItem = apps.get_model('recipes', 'ShoppingCartItem')
+    totals = IngredientRecipe.objects.filter(
+        recipe__is_in_shopping_list__isnull=False
+    ).values(
+        'recipe__is_in_shopping_list__user', 'ingredient'
+    ).annotate(total_amount=models.Sum('amount')).order_by()
+    ShoppingCartItem.objects.bulk_create(
+        (ShoppingCartItem(
+            user_id=row['recipe__is_in_shopping_list__user'],
+            ingredient_id=row['ingredient'],
+            total_amount=row['total_amount'])
+         for row in totals.iterator()),
+        batch_size=1000
+    )
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0003_auto_20230112_1012'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShoppingCartItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_amount', models.PositiveIntegerField(help_text='Суммарное количество', verbose_name='Количество')),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_cart_items', to='recipes.ingredient', verbose_name='Ингредиент')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_cart_items', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Ингредиент в списке покупок',
+                'verbose_name_plural': 'Ингредиенты в списке покупок',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='shoppingcartitem',
+            constraint=models.UniqueConstraint(fields=('user', 'ingredient'), name='user_and_cart_ingredient_have_unique_relationships'),
+        ),
+        migrations.RunPython(
+            fill_shopping_cart_items, migrations.RunPython.noop
+        ),
+    ]
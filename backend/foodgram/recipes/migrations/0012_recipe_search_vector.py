@@ -0,0 +1,62 @@
+from django.db import migrations
+
+SEARCH_VECTOR = (
+    "setweight(to_tsvector('russian', coalesce({row}name, '')), 'A') || "
+    "setweight(to_tsvector('russian', coalesce({row}text, '')), 'B')"
+)
+
+
+def create_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'ALTER TABLE recipes_recipe '
+        'ADD COLUMN IF NOT EXISTS search_vector tsvector'
+    )
+    schema_editor.execute(
+        'CREATE OR REPLACE FUNCTION recipes_recipe_search_vector_update() '
+        'RETURNS trigger AS $$ BEGIN '
+        f'NEW.search_vector := {SEARCH_VECTOR.format(row="NEW.")}; '
+        'RETURN NEW; END $$ LANGUAGE plpgsql'
+    )
+    schema_editor.execute(
+        'DROP TRIGGER IF EXISTS recipes_recipe_search_vector_trigger '
+        'ON recipes_recipe'
+    )
+    schema_editor.execute(
+        'CREATE TRIGGER recipes_recipe_search_vector_trigger '
+        'BEFORE INSERT OR UPDATE OF name, text ON recipes_recipe '
+        'FOR EACH ROW EXECUTE PROCEDURE recipes_recipe_search_vector_update()'
+    )
+    schema_editor.execute(
+        'UPDATE recipes_recipe '
+        f'SET search_vector = {SEARCH_VECTOR.format(row="")}'
+    )
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS recipes_recipe_search_vector_idx '
+        'ON recipes_recipe USING gin (search_vector)'
+    )
+
+
+def drop_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'DROP TRIGGER IF EXISTS recipes_recipe_search_vector_trigger '
+        'ON recipes_recipe'
+    )
+    schema_editor.execute(
+        'DROP FUNCTION IF EXISTS recipes_recipe_search_vector_update()')
+    schema_editor.execute(
+        'ALTER TABLE recipes_recipe DROP COLUMN IF EXISTS search_vector')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0011_recipe_image_storage'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_vector, drop_search_vector),
+    ]
@@ -1,8 +1,13 @@
+from collections import defaultdict
+
 from colorfield.fields import ColorField
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import connections, models
+from django.db.models.functions import Greatest
 from foodgram.settings import MIN_AMOUNT, MIN_COOKING_TIME
-from users.models import User
+from recipes import search
+from recipes.storage import ContentAddressedStorage
+from users.models import CountersMixin, LinkQuerySet, Subscription, User
 
 
 class Tag(models.Model):
@@ -58,7 +63,74 @@ class Ingredient(models.Model):
         return self.name
 
 
-class Recipe(models.Model):
+class RecipeQuerySet(models.QuerySet):
+    """Запросы ленты рецептов с постоянным числом обращений к базе."""
+
+    def with_related(self):
+        return self.select_related('author').prefetch_related(
+            'tags',
+            models.Prefetch(
+                'ingredients',
+                queryset=IngredientRecipe.objects.select_related('ingredient')
+            )
+        )
+
+    def with_user_flags(self, user):
+        if not user.is_authenticated:
+            false = models.Value(False, output_field=models.BooleanField())
+            return self.annotate(
+                favorited=false,
+                in_shopping_cart=false,
+                author_is_subscribed=false
+            )
+        return self.annotate(
+            favorited=models.Exists(Favorite.objects.filter(
+                user=user, recipe=models.OuterRef('pk'))),
+            in_shopping_cart=models.Exists(ShoppingList.objects.filter(
+                user=user, recipe=models.OuterRef('pk'))),
+            author_is_subscribed=models.Exists(Subscription.objects.filter(
+                subscriber=user, author=models.OuterRef('author')))
+        )
+
+    def for_feed(self, user):
+        return self.with_related().with_user_flags(user)
+
+    def latest_per_author(self, limit=None):
+        if limit is None:
+            return self
+        latest = self.model.objects.filter(
+            author=models.OuterRef('author')
+        ).values('pk')[:limit]
+        return self.filter(pk__in=models.Subquery(latest))
+
+    def search(self, value):
+        """Рецепты, подходящие под запрос, по убыванию релевантности."""
+        if connections[self.db].vendor != 'postgresql':
+            recipe_ids = search.get_index().search(value)
+            if not recipe_ids:
+                return self.none()
+            return self.filter(pk__in=recipe_ids).order_by(models.Case(
+                *(models.When(pk=recipe_id, then=position)
+                  for position, recipe_id in enumerate(recipe_ids)),
+                default=len(recipe_ids)
+            ))
+        from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                                    SearchVectorField)
+
+        query = SearchQuery(
+            value, config=search.SEARCH_CONFIG, search_type='websearch')
+        vector = models.expressions.RawSQL(
+            f'"{self.model._meta.db_table}"."search_vector"', (),
+            output_field=SearchVectorField()
+        )
+        return self.alias(search_vector=vector).filter(
+            search_vector=query
+        ).annotate(
+            search_rank=SearchRank(vector, query)
+        ).order_by('-search_rank', '-id')
+
+
+class Recipe(CountersMixin, models.Model):
     tags = models.ManyToManyField(
         Tag,
         verbose_name='Тег',
@@ -78,6 +150,7 @@ class Recipe(models.Model):
 
     image = models.ImageField(
         upload_to='recipes/images/',
+        storage=ContentAddressedStorage(),
         default=None,
         verbose_name='Изображение'
     )
@@ -90,11 +163,35 @@ class Recipe(models.Model):
         verbose_name='Время приготовления, мин',
         help_text='Время приготовления, мин',
     )
+    updated_at = models.DateTimeField(
+        verbose_name='Дата изменения',
+        auto_now=True,
+        db_index=True
+    )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='Количество добавлений в избранное',
+        default=0,
+        editable=False
+    )
+    renditions_ready = models.BooleanField(
+        verbose_name='Уменьшенные копии изображения готовы',
+        default=False,
+        editable=False
+    )
+
+    objects = RecipeQuerySet.as_manager()
+    update_only_fields = ('favorites_count', 'renditions_ready')
 
     class Meta:
         ordering = ('-id',)
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = (
+            models.Index(
+                name='recipe_author_id_idx',
+                fields=('author', '-id')
+            ),
+        )
 
     def __str__(self) -> str:
         return self.name
@@ -121,6 +218,12 @@ class TagRecipe(models.Model):
                 fields=('tag', 'recipe')
             ),
         )
+        indexes = (
+            models.Index(
+                name='tagrecipe_recipe_tag_idx',
+                fields=('recipe', 'tag')
+            ),
+        )
 
     def __str__(self) -> str:
         return f'Тег {self.tag} относится к рецепту {self.recipe}'
@@ -146,6 +249,8 @@ class IngredientRecipe(models.Model):
 
     )
 
+    objects = LinkQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Ингредиент  в рецепте'
         verbose_name_plural = 'Ингредиенты в рецептах'
@@ -176,6 +281,8 @@ class Favorite(models.Model):
         on_delete=models.CASCADE
     )
 
+    objects = LinkQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Избранный рецепт'
         verbose_name_plural = 'Избранные рецепты'
@@ -185,6 +292,12 @@ class Favorite(models.Model):
                 fields=('user', 'recipe')
             ),
         )
+        indexes = (
+            models.Index(
+                name='favorite_recipe_user_idx',
+                fields=('recipe', 'user')
+            ),
+        )
 
     def __str__(self) -> str:
         return f'У {self.user} в избранном рецепт {self.recipe}.'
@@ -206,6 +319,8 @@ class ShoppingList(models.Model):
         on_delete=models.CASCADE
     )
 
+    objects = LinkQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Рецепт в списке покупок'
         verbose_name_plural = 'Рецепты в списке покупок'
@@ -215,6 +330,107 @@ class ShoppingList(models.Model):
                 fields=('user', 'recipe')
             ),
         )
+        indexes = (
+            models.Index(
+                name='shoppinglist_recipe_user_idx',
+                fields=('recipe', 'user')
+            ),
+        )
 
     def __str__(self) -> str:
         return f'У {self.user} в списке покупок рецепт {self.recipe}.'
+
+
+class ShoppingCartItemQuerySet(models.QuerySet):
+    """Инкрементальное обновление агрегированного списка покупок."""
+
+    def change(self, user_ids, deltas):
+        """Прибавляет deltas по ингредиентам к спискам покупок user_ids.
+
+        Все изменения применяются одним UPDATE с CASE по ингредиентам,
+        строки для новых ингредиентов создаются заранее, обнуленные
+        удаляются.
+        """
+        user_ids = list(user_ids)
+        deltas = {
+            ingredient_id: delta
+            for ingredient_id, delta in deltas.items() if delta
+        }
+        if not user_ids or not deltas:
+            return
+        if any(delta > 0 for delta in deltas.values()):
+            self.bulk_create(
+                (self.model(user_id=user_id, ingredient_id=ingredient_id,
+                            total_amount=0)
+                 for user_id in user_ids
+                 for ingredient_id, delta in deltas.items() if delta > 0),
+                ignore_conflicts=True
+            )
+        items = self.filter(user_id__in=user_ids, ingredient_id__in=deltas)
+        items.update(total_amount=Greatest(
+            models.Case(
+                *(models.When(ingredient_id=ingredient_id,
+                              then=models.F('total_amount') + delta)
+                  for ingredient_id, delta in deltas.items()),
+                output_field=models.IntegerField()
+            ),
+            0
+        ))
+        if any(delta < 0 for delta in deltas.values()):
+            items.filter(total_amount=0).delete()
+
+    def change_recipes(self, user_id, added=(), removed=()):
+        """Учитывает id рецептов, добавленных в список и удаленных из него."""
+        added = set(added)
+        amounts = IngredientRecipe.objects.filter(
+            recipe_id__in=added.union(removed)
+        ).values_list('recipe_id', 'ingredient_id', 'amount')
+        deltas = defaultdict(int)
+        for recipe_id, ingredient_id, amount in amounts:
+            deltas[ingredient_id] += amount if recipe_id in added else -amount
+        self.change((user_id, ), deltas)
+
+    def change_recipe(self, recipe_id, deltas):
+        """Учитывает изменение ингредиентов рецепта у всех, кто его добавил."""
+        self.change(
+            ShoppingList.objects.filter(recipe_id=recipe_id).values_list(
+                'user_id', flat=True),
+            deltas
+        )
+
+
+class ShoppingCartItem(models.Model):
+    """Суммарное количество ингредиента в списке покупок пользователя."""
+
+    user = models.ForeignKey(
+        User,
+        verbose_name='Пользователь',
+        related_name='shopping_cart_items',
+        on_delete=models.CASCADE
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        verbose_name='Ингредиент',
+        related_name='shopping_cart_items',
+        on_delete=models.CASCADE
+    )
+    total_amount = models.PositiveIntegerField(
+        verbose_name='Количество',
+        help_text='Суммарное количество'
+    )
+
+    objects = ShoppingCartItemQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Ингредиент в списке покупок'
+        verbose_name_plural = 'Ингредиенты в списке покупок'
+        constraints = (
+            models.UniqueConstraint(
+                name='user_and_cart_ingredient_have_unique_relationships',
+                fields=('user', 'ingredient')
+            ),
+        )
+
+    def __str__(self) -> str:
+        return (f'У {self.user} в списке покупок '
+                f'{self.total_amount} {self.ingredient}.')
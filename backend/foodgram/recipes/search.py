@@ -0,0 +1,94 @@
+"""Полнотекстовый поиск рецептов по названию и описанию.
+
+В PostgreSQL поиск идет по колонке search_vector с GIN-индексом, которую
+поддерживает триггер (миграция 0012). Для остальных баз, например SQLite
+в тестовых запусках, процесс держит инвертированный индекс в памяти и
+перестраивает его при смене версии рецептов в общем кэше.
+"""
+import re
+from collections import defaultdict
+from threading import Lock
+
+from recipes import versions
+
+SEARCH_CONFIG = 'russian'
+NAME_WEIGHT = 1.0
+TEXT_WEIGHT = 0.4
+WORD = re.compile(r'\w+')
+ENDINGS = tuple(sorted((
+    'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими',
+    'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ой', 'ей', 'ий', 'ый', 'ом',
+    'ем', 'ам', 'ям', 'ах', 'ях', 'ов', 'ев', 'ую', 'юю', 'ть', 'ти',
+    'ы', 'и', 'а', 'я', 'о', 'е', 'у', 'ю', 'ь', 'й',
+), key=len, reverse=True))
+MIN_STEM = 3
+
+
+def stem(word):
+    """Упрощенный стемминг: отбрасывает самое длинное окончание."""
+    for ending in ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+
+def tokenize(text):
+    return [stem(word) for word in WORD.findall(text.lower())]
+
+
+class SearchIndex:
+    """Инвертированный индекс: основа слова -> {id рецепта: вес}."""
+
+    __slots__ = ('version', 'postings')
+
+    def __init__(self, version, rows):
+        self.version = version
+        postings = defaultdict(lambda: defaultdict(float))
+        for recipe_id, name, text in rows:
+            for token in tokenize(name):
+                postings[token][recipe_id] += NAME_WEIGHT
+            for token in tokenize(text):
+                postings[token][recipe_id] += TEXT_WEIGHT
+        self.postings = {
+            token: dict(weights) for token, weights in postings.items()
+        }
+
+    def search(self, value):
+        """Id рецептов, содержащих все слова запроса, по убыванию веса."""
+        tokens = set(tokenize(value))
+        if not tokens:
+            return []
+        postings = sorted(
+            (self.postings.get(token, {}) for token in tokens), key=len)
+        matched = set(postings[0])
+        for weights in postings[1:]:
+            matched.intersection_update(weights)
+        return sorted(
+            matched,
+            key=lambda recipe_id: (
+                -sum(weights[recipe_id] for weights in postings), -recipe_id)
+        )
+
+
+_index = None
+_lock = Lock()
+
+
+def load(version):
+    from recipes.models import Recipe
+
+    return SearchIndex(version, Recipe.objects.values_list(
+        'id', 'name', 'text').iterator())
+
+
+def get_index():
+    global _index
+    version = versions.get_version(versions.RECIPES)
+    index = _index
+    if index is not None and index.version == version:
+        return index
+    with _lock:
+        index = _index
+        if index is None or index.version != version:
+            _index = index = load(version)
+    return index
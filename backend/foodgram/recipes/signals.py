@@ -0,0 +1,180 @@
+from collections import defaultdict
+
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from recipes import matching, versions
+from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
+                            ShoppingCartItem, ShoppingList, Tag, TagRecipe)
+from users.models import Subscription, User
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_catalog(sender, **kwargs):
+    versions.bump_on_commit(versions.CATALOG)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_save, sender=TagRecipe)
+@receiver(post_delete, sender=TagRecipe)
+@receiver(post_save, sender=IngredientRecipe)
+@receiver(post_delete, sender=IngredientRecipe)
+@receiver(post_delete, sender=User)
+def invalidate_recipes(sender, **kwargs):
+    versions.bump_on_commit(versions.RECIPES)
+
+
+@receiver(post_save, sender=User)
+def invalidate_recipes_authors(sender, instance, created=False,
+                               update_fields=None, **kwargs):
+    # В рецептах видны только данные их авторов: регистрация, вход и
+    # правка пользователя без рецептов на них не влияют.
+    if created or update_fields and set(update_fields) <= {'last_login'}:
+        return
+    if not Recipe.objects.filter(author=instance).exists():
+        return
+    versions.bump_on_commit(versions.RECIPES)
+    versions.touch_on_commit(versions.author_key(instance.id))
+
+
+@receiver(post_delete, sender=Recipe)
+def forget_matching_recipe(sender, instance, **kwargs):
+    matching.log_deleted_on_commit(instance.id)
+
+
+@receiver(post_save, sender=Recipe)
+def invalidate_feed_recipe(sender, instance, created=False, **kwargs):
+    saved_author = getattr(instance, 'saved_target', None)
+    if created or saved_author and saved_author != instance.author_id:
+        versions.bump_on_commit(versions.FEED)
+    else:
+        versions.touch_on_commit(versions.recipe_key(instance.id))
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_save, sender=TagRecipe)
+@receiver(post_delete, sender=TagRecipe)
+def invalidate_feed(sender, **kwargs):
+    versions.bump_on_commit(versions.FEED)
+
+
+@receiver(post_save, sender=IngredientRecipe)
+@receiver(post_delete, sender=IngredientRecipe)
+def invalidate_feed_ingredients(sender, instance, **kwargs):
+    versions.touch_on_commit(versions.recipe_key(instance.recipe_id))
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+@receiver(post_save, sender=ShoppingList)
+@receiver(post_delete, sender=ShoppingList)
+def invalidate_user_recipes(sender, instance, **kwargs):
+    versions.bump_on_commit(versions.user_key(instance.user_id))
+
+
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+def invalidate_user_subscriptions(sender, instance, **kwargs):
+    versions.bump_on_commit(versions.user_key(instance.subscriber_id))
+
+
+# Поле связи, по которому ведется счетчик: при его смене в админке
+# счетчик переносится со старого объекта на новый.
+COUNTED_FIELDS = {
+    Favorite: 'recipe_id',
+    Recipe: 'author_id',
+    Subscription: 'author_id',
+}
+
+
+@receiver(pre_save, sender=Favorite)
+@receiver(pre_save, sender=Recipe)
+@receiver(pre_save, sender=Subscription)
+def remember_counted_target(sender, instance, **kwargs):
+    instance.saved_target = instance.pk and sender.objects.filter(
+        pk=instance.pk).values_list(COUNTED_FIELDS[sender], flat=True).first()
+
+
+def change_counter(model, field, instance, target_id, created, signal):
+    if signal is post_delete or created:
+        model.change_counter(target_id, field, 1 if created else -1)
+        return
+    previous = getattr(instance, 'saved_target', None)
+    if previous and previous != target_id:
+        model.change_counter(previous, field, -1)
+        model.change_counter(target_id, field, 1)
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+def count_favorites(sender, instance, created=False, **kwargs):
+    change_counter(Recipe, 'favorites_count', instance, instance.recipe_id,
+                   created, kwargs['signal'])
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def count_recipes(sender, instance, created=False, **kwargs):
+    change_counter(User, 'recipes_count', instance, instance.author_id,
+                   created, kwargs['signal'])
+
+
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+def count_subscribers(sender, instance, created=False, **kwargs):
+    change_counter(User, 'subscribers_count', instance, instance.author_id,
+                   created, kwargs['signal'])
+
+
+@receiver(pre_save, sender=ShoppingList)
+def remember_shopping_list(sender, instance, **kwargs):
+    instance.saved_link = instance.pk and ShoppingList.objects.filter(
+        pk=instance.pk).values_list('user_id', 'recipe_id').first()
+
+
+@receiver(post_save, sender=ShoppingList)
+@receiver(post_delete, sender=ShoppingList)
+def count_shopping_cart(sender, instance, created=False, **kwargs):
+    saved_link = getattr(instance, 'saved_link', None)
+    if kwargs['signal'] is post_delete:
+        ShoppingCartItem.objects.change_recipes(
+            instance.user_id, removed=(instance.recipe_id, ))
+    elif created:
+        ShoppingCartItem.objects.change_recipes(
+            instance.user_id, added=(instance.recipe_id, ))
+    elif saved_link and saved_link != (instance.user_id, instance.recipe_id):
+        user_id, recipe_id = saved_link
+        ShoppingCartItem.objects.change_recipes(
+            user_id, removed=(recipe_id, ))
+        versions.bump_on_commit(versions.user_key(user_id))
+        ShoppingCartItem.objects.change_recipes(
+            instance.user_id, added=(instance.recipe_id, ))
+
+
+@receiver(pre_save, sender=IngredientRecipe)
+def remember_ingredient_amount(sender, instance, **kwargs):
+    instance.saved_amount = instance.pk and IngredientRecipe.objects.filter(
+        pk=instance.pk).values_list('ingredient_id', 'amount').first()
+
+
+@receiver(post_save, sender=IngredientRecipe)
+@receiver(post_delete, sender=IngredientRecipe)
+def count_shopping_cart_ingredients(sender, instance, **kwargs):
+    """Переносит правку ингредиента рецепта в списки покупок.
+
+    При каскадном удалении рецепта его строки ShoppingList и
+    IngredientRecipe удаляются в любом порядке: кто удален вторым, уже
+    не находит пары, поэтому количество вычитается ровно один раз.
+    """
+    deltas = defaultdict(int)
+    if kwargs['signal'] is post_delete:
+        deltas[instance.ingredient_id] -= instance.amount
+    else:
+        if getattr(instance, 'saved_amount', None):
+            ingredient_id, amount = instance.saved_amount
+            deltas[ingredient_id] -= amount
+        deltas[instance.ingredient_id] += instance.amount
+    ShoppingCartItem.objects.change_recipe(instance.recipe_id, deltas)
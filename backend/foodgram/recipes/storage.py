@@ -0,0 +1,50 @@
+"""Хранилище изображений рецептов с адресацией по содержимому."""
+import hashlib
+import os
+import posixpath
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+HASH_CHUNK = 64 * 1024
+
+
+def content_digest(content):
+    digest = hashlib.sha256()
+    for chunk in content.chunks(HASH_CHUNK):
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """Файловое хранилище, в котором имя файла - хэш его содержимого.
+
+    Одинаковые файлы хранятся один раз: если файл с таким хэшем уже есть,
+    запись пропускается, а у файла обновляется время изменения. Файлы, на
+    которые больше нет ссылок, удаляет команда gc_media.
+    """
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        directory, basename = posixpath.split(name)
+        digest = content_digest(content)
+        name = posixpath.join(
+            directory, digest[:2],
+            digest + os.path.splitext(basename)[1].lower())
+        try:
+            # Свежее время изменения не дает gc_media удалить файл, пока
+            # ссылка на него еще не сохранена в базе.
+            os.utime(self.path(name))
+        except FileNotFoundError:
+            pass
+        else:
+            return name
+        saved = super().save(name, content, max_length=max_length)
+        if saved != name:
+            # Тот же файл успели записать параллельно.
+            self.delete(saved)
+        return name
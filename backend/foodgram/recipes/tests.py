@@ -0,0 +1,83 @@
+import re
+from io import StringIO
+from unittest import skipUnless
+
+from api.tests import LOCMEM_CACHES
+from django.db import connection
+from django.db.models import Exists, OuterRef
+from django.test import TestCase, override_settings
+from recipes import fixtures
+from recipes.models import (Favorite, Recipe, ShoppingCartItem, ShoppingList,
+                            TagRecipe)
+from users.models import Subscription, User
+
+SEQ_SCAN = re.compile(r'Seq Scan on (\w+)')
+WATCHED_TABLES = {
+    Recipe._meta.db_table,
+    Favorite._meta.db_table,
+    ShoppingList._meta.db_table,
+    ShoppingCartItem._meta.db_table,
+    TagRecipe._meta.db_table,
+    Subscription._meta.db_table,
+}
+# На малых объемах планировщик предпочитает последовательное сканирование.
+REPRESENTATIVE_RECIPES = 10000
+
+
+def hot_queries(user, author, tag_ids):
+    """Запросы, которые выполняют api.views и api.filters."""
+    feed = Recipe.objects.for_feed(user)
+    return {
+        'лента рецептов': feed[:6],
+        'рецепты автора': feed.filter(author=author)[:6],
+        'фильтр по тегам': feed.filter(Exists(TagRecipe.objects.filter(
+            recipe=OuterRef('pk'), tag_id__in=tag_ids)))[:6],
+        'поиск по тексту': feed.search('суп')[:6],
+        'избранное пользователя': feed.filter(
+            is_favorited__user=user)[:6],
+        'список покупок пользователя': feed.filter(
+            is_in_shopping_list__user=user)[:6],
+        'скачивание списка покупок': ShoppingCartItem.objects.filter(
+            user=user).values_list(
+                'ingredient__name', 'ingredient__measurement_unit',
+                'total_amount').order_by('ingredient__name'),
+        'подписки пользователя': User.objects.filter(
+            is_subscribed__subscriber=user).order_by('id')[:6],
+        'последние рецепты авторов': Recipe.objects.filter(
+            author__in=Subscription.objects.filter(
+                subscriber=user).values('author')[:6]
+        ).latest_per_author(3),
+        'подписчики автора': Subscription.objects.filter(author=author),
+        'в избранном у пользователей': Favorite.objects.filter(
+            recipe_id=Recipe.objects.values('pk')[:1]),
+    }
+
+
+@skipUnless(connection.vendor == 'postgresql',
+            'Планы запросов проверяются только для PostgreSQL')
+@override_settings(CACHES=LOCMEM_CACHES)
+class QueryPlansTest(TestCase):
+    """Основные запросы API не сканируют таблицы рецептов целиком."""
+
+    @classmethod
+    def setUpTestData(cls):
+        fixtures.generate(REPRESENTATIVE_RECIPES, stdout=StringIO())
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        cls.user = User.objects.filter(subscriber__isnull=False).first()
+        cls.author = Recipe.objects.values_list(
+            'author', flat=True).first()
+        cls.tag_ids = list(TagRecipe.objects.values_list(
+            'tag_id', flat=True).distinct()[:2])
+
+    def test_no_seq_scan(self):
+        queries = hot_queries(self.user, self.author, self.tag_ids)
+        for name, queryset in queries.items():
+            with self.subTest(name):
+                if queryset.query.is_empty():
+                    continue
+                plan = queryset.explain()
+                self.assertFalse(
+                    WATCHED_TABLES.intersection(SEQ_SCAN.findall(plan)),
+                    plan
+                )
@@ -0,0 +1,97 @@
+"""Версии данных в общем кэше.
+
+Версия меняется при каждом изменении данных и позволяет без запросов к
+базе понять, устарели ли закэшированные в процессе или у клиента данные.
+Для отдельных рецептов и авторов вместо версии хранится время последнего
+изменения (touch): по нему кэш ленты отличает данные, прочитанные до
+изменения, от прочитанных после.
+"""
+import time
+from uuid import uuid4
+
+from django.core.cache import cache, caches
+from django.db import transaction
+
+CATALOG = 'recipes:version:catalog'
+RECIPES = 'recipes:version:recipes'
+# Состав ленты: меняется при создании и удалении рецептов, смене их тегов
+# и авторов, но не при правке полей рецепта.
+FEED = 'recipes:version:feed'
+# Общие версии лежат в отдельном кэше, где их не вытеснят страницы ленты
+# и версии отдельных пользователей.
+GLOBAL_KEYS = (CATALOG, RECIPES, FEED)
+TOUCH_TIMEOUT = 60 * 60
+
+
+def user_key(user_id):
+    return f'recipes:version:user:{user_id}'
+
+
+def recipe_key(recipe_id):
+    return f'recipes:touched:recipe:{recipe_id}'
+
+
+def author_key(user_id):
+    return f'recipes:touched:author:{user_id}'
+
+
+def get_cache(key):
+    return caches['versions'] if key in GLOBAL_KEYS else cache
+
+
+def get_version(key):
+    store = get_cache(key)
+    version = store.get(key)
+    if version is not None:
+        return version
+    store.add(key, uuid4().hex, None)
+    return store.get(key)
+
+
+def get_versions(*keys):
+    versions = caches['versions'].get_many(
+        [key for key in keys if key in GLOBAL_KEYS])
+    versions.update(cache.get_many(
+        [key for key in keys if key not in GLOBAL_KEYS]))
+    for key in keys:
+        if key not in versions:
+            versions[key] = get_version(key)
+    return [versions[key] for key in keys]
+
+
+def bump(*keys):
+    shared = {key: uuid4().hex for key in keys if key in GLOBAL_KEYS}
+    if shared:
+        caches['versions'].set_many(shared, None)
+    if len(shared) < len(keys):
+        cache.set_many(
+            {key: uuid4().hex for key in keys if key not in shared}, None)
+
+
+def bump_on_commit(*keys):
+    transaction.on_commit(lambda: bump(*keys))
+
+
+def touch(*keys):
+    now = time.time()
+    cache.set_many({key: now for key in keys}, TOUCH_TIMEOUT)
+
+
+def touch_on_commit(*keys):
+    transaction.on_commit(lambda: touch(*keys))
+
+
+def get_touched(*keys):
+    """Время последнего изменения по ключам.
+
+    Для ключа, которого нет в кэше (еще не менялся, истек или вытеснен),
+    запоминается текущее время: так пропавшая запись выглядит как свежее
+    изменение, а не как его отсутствие.
+    """
+    touched = cache.get_many(keys)
+    now = time.time()
+    for key in keys:
+        if key not in touched:
+            cache.add(key, now, TOUCH_TIMEOUT)
+            touched[key] = cache.get(key, now)
+    return touched
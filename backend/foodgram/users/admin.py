@@ -11,6 +11,8 @@ class UserAdmin(admin.ModelAdmin):
         'first_name',
         'last_name',
         'password',
+        'recipes_count',
+        'subscribers_count',
     )
     list_filter = (
         'email',
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.14 on 2026-10-18 18:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_auto_20230112_1012'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='subscription',
+            index=models.Index(fields=['author', 'subscriber'], name='subscription_author_idx'),
+        ),
+    ]
@@ -1,8 +1,135 @@
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.core.exceptions import EmptyResultSet
+from django.db import connections, models
+from django.db.models import Count, F, OuterRef, Subquery, signals, sql
+from django.db.models.functions import Coalesce, Greatest
 
 
-class User(AbstractUser):
+def count_related(model, field):
+    """Подзапрос с числом строк model, ссылающихся на объект полем field."""
+    return Coalesce(Subquery(
+        model.objects.filter(
+            **{field: OuterRef('pk')}
+        ).order_by().values(field).annotate(
+            total=Count('pk')).values('total')
+    ), 0)
+
+
+class CountersMixin:
+    """Денормализованные счетчики, которые меняются только через F().
+
+    save() уже загруженного объекта не записывает поля из
+    update_only_fields (счетчики и флаги фоновой обработки), чтобы не
+    затереть значения, изменённые другими запросами.
+    """
+
+    update_only_fields = ()
+
+    def save(self, *args, update_fields=None, **kwargs):
+        if update_fields is None and not self._state.adding:
+            update_fields = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.update_only_fields
+            ]
+        super().save(*args, update_fields=update_fields, **kwargs)
+
+    @classmethod
+    def change_counter(cls, pk, field, delta):
+        cls._default_manager.filter(pk=pk).update(
+            **{field: Greatest(F(field) + delta, 0)})
+
+    @classmethod
+    def recount_counter(cls, pks, field, related_model, related_field):
+        """Пересчитывает счетчик объектов pks одним UPDATE."""
+        cls._default_manager.filter(pk__in=pks).update(
+            **{field: count_related(related_model, related_field)})
+
+
+class LinkQuerySet(models.QuerySet):
+    """Добавление и удаление связи одним запросом без гонки.
+
+    Проверка и запись выполняются одним INSERT ... ON CONFLICT DO NOTHING
+    или DELETE. Сигналы post_save и post_delete отправляются вручную и
+    только если строка действительно добавлена или удалена, поэтому
+    обработчики счетчиков и версий кэша срабатывают как при save().
+    Поля должны однозначно определять связь (уникальную пару).
+    """
+
+    def add(self, **fields):
+        statement, params = self._insert_sql([fields])
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(statement, params)
+            added = cursor.rowcount > 0
+        if added:
+            signals.post_save.send(
+                sender=self.model, instance=self.model(**fields),
+                created=True, update_fields=None, raw=False, using=self.db)
+        return added
+
+    def remove(self, **fields):
+        removed = self.filter(**fields).bulk_remove() > 0
+        if removed:
+            signals.post_delete.send(
+                sender=self.model, instance=self.model(**fields),
+                using=self.db)
+        return removed
+
+    def bulk_add(self, rows, returning):
+        """Добавляет строки одним INSERT без сигналов.
+
+        Возвращает значения поля returning только у действительно
+        добавленных строк (нужен RETURNING: PostgreSQL или SQLite 3.35+).
+        """
+        rows = list(rows)
+        if not rows:
+            return []
+        return self._execute_returning(*self._insert_sql(rows), returning)
+
+    def bulk_remove(self, returning=None):
+        """Удаляет строки одним DELETE без сигналов.
+
+        Возвращает их число, а с returning - значения этого поля у
+        удаленных строк.
+        """
+        try:
+            statement, params = self._delete_sql()
+        except EmptyResultSet:
+            return [] if returning else 0
+        if returning:
+            return self._execute_returning(statement, params, returning)
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(statement, params)
+            return cursor.rowcount
+
+    # SQL собирается внутренними классами Django 3.2 (sql.InsertQuery,
+    # sql.DeleteQuery и их компиляторами): публичный API не умеет
+    # INSERT ... ON CONFLICT DO NOTHING с числом вставленных строк и
+    # DELETE без Collector. При обновлении Django проверить эти два метода
+    # тестами users.tests.LinkQuerySetTest.
+    def _insert_sql(self, rows):
+        query = sql.InsertQuery(self.model, ignore_conflicts=True)
+        query.insert_values(
+            [self.model._meta.get_field(name) for name in rows[0]],
+            [self.model(**fields) for fields in rows]
+        )
+        (statement, params), = query.get_compiler(self.db).as_sql()
+        return statement, params
+
+    def _delete_sql(self):
+        query = self.query.chain(sql.DeleteQuery)
+        return query.get_compiler(self.db).as_sql()
+
+    def _execute_returning(self, statement, params, field_name):
+        connection = connections[self.db]
+        column = connection.ops.quote_name(
+            self.model._meta.get_field(field_name).column)
+        with connection.cursor() as cursor:
+            cursor.execute(f'{statement} RETURNING {column}', params)
+            return [value for value, in cursor.fetchall()]
+
+
+class User(CountersMixin, AbstractUser):
     """Кастомная модель пользователя User"""
 
     email = models.EmailField(
@@ -32,6 +159,18 @@ class User(AbstractUser):
         help_text='Пароль',
         max_length=150
     )
+    recipes_count = models.PositiveIntegerField(
+        verbose_name='Количество рецептов',
+        default=0,
+        editable=False
+    )
+    subscribers_count = models.PositiveIntegerField(
+        verbose_name='Количество подписчиков',
+        default=0,
+        editable=False
+    )
+
+    update_only_fields = ('recipes_count', 'subscribers_count')
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ('username', 'password')
@@ -61,6 +200,8 @@ class Subscription(models.Model):
         help_text='Имена авторов, на которых подписан'
     )
 
+    objects = LinkQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
@@ -74,6 +215,12 @@ class Subscription(models.Model):
                 fields=('subscriber', 'author')
             )
         )
+        indexes = (
+            models.Index(
+                name='subscription_author_idx',
+                fields=('author', 'subscriber')
+            ),
+        )
 
     def __str__(self) -> str:
         return f'У {self.subscriber} подписан на {self.author}.'
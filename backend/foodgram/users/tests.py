@@ -0,0 +1,107 @@
+from unittest import skipUnless
+
+from api.tests import LOCMEM_CACHES
+from django.db import connection
+from django.test import TestCase, override_settings
+from recipes.models import Favorite, Recipe
+from users.models import Subscription, User
+
+# RETURNING есть в PostgreSQL и в SQLite начиная с 3.35.
+SUPPORTS_RETURNING = connection.vendor == 'postgresql' or (
+    connection.vendor == 'sqlite'
+    and connection.Database.sqlite_version_info >= (3, 35)
+)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class LinkQuerySetTest(TestCase):
+    """Добавление и удаление связей запросами в обход ORM."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pass')
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com', password='pass')
+        cls.recipes = [
+            Recipe.objects.create(
+                author=cls.author, name=f'recipe{i}', text='text',
+                cooking_time=10, image='recipes/image.png')
+            for i in range(3)
+        ]
+
+    def favorites_count(self, recipe):
+        recipe.refresh_from_db(fields=['favorites_count'])
+        return recipe.favorites_count
+
+    def test_add(self):
+        recipe = self.recipes[0]
+        self.assertTrue(Favorite.objects.add(user=self.user, recipe=recipe))
+        self.assertFalse(Favorite.objects.add(user=self.user, recipe=recipe))
+        self.assertEqual(
+            Favorite.objects.filter(user=self.user, recipe=recipe).count(), 1)
+        self.assertEqual(self.favorites_count(recipe), 1)
+
+    def test_remove(self):
+        recipe = self.recipes[0]
+        Favorite.objects.add(user=self.user, recipe=recipe)
+        self.assertTrue(
+            Favorite.objects.remove(user=self.user, recipe=recipe))
+        self.assertFalse(
+            Favorite.objects.remove(user=self.user, recipe=recipe))
+        self.assertFalse(Favorite.objects.exists())
+        self.assertEqual(self.favorites_count(recipe), 0)
+
+    def test_subscription(self):
+        self.assertTrue(Subscription.objects.add(
+            subscriber=self.user, author=self.author))
+        self.assertFalse(Subscription.objects.add(
+            subscriber=self.user, author=self.author))
+        self.author.refresh_from_db(fields=['subscribers_count'])
+        self.assertEqual(self.author.subscribers_count, 1)
+        self.assertTrue(Subscription.objects.remove(
+            subscriber=self.user, author=self.author))
+        self.author.refresh_from_db(fields=['subscribers_count'])
+        self.assertEqual(self.author.subscribers_count, 0)
+
+    @skipUnless(SUPPORTS_RETURNING, 'База не поддерживает RETURNING')
+    def test_bulk_add(self):
+        Favorite.objects.create(user=self.user, recipe=self.recipes[0])
+        added = Favorite.objects.bulk_add(
+            [{'user_id': self.user.id, 'recipe_id': recipe.id}
+             for recipe in self.recipes],
+            returning='recipe_id'
+        )
+        self.assertCountEqual(
+            added, [recipe.id for recipe in self.recipes[1:]])
+        self.assertEqual(Favorite.objects.count(), 3)
+        self.assertEqual(Favorite.objects.bulk_add([], 'recipe_id'), [])
+
+    @skipUnless(SUPPORTS_RETURNING, 'База не поддерживает RETURNING')
+    def test_bulk_remove_returning(self):
+        for recipe in self.recipes[:2]:
+            Favorite.objects.create(user=self.user, recipe=recipe)
+        removed = Favorite.objects.filter(
+            user=self.user, recipe__in=self.recipes
+        ).bulk_remove(returning='recipe_id')
+        self.assertCountEqual(
+            removed, [recipe.id for recipe in self.recipes[:2]])
+        self.assertFalse(Favorite.objects.exists())
+        self.assertEqual(
+            Favorite.objects.filter(recipe__in=[]).bulk_remove(
+                returning='recipe_id'),
+            []
+        )
+
+    def test_bulk_remove(self):
+        for recipe in self.recipes:
+            Favorite.objects.create(user=self.user, recipe=recipe)
+        self.assertEqual(
+            Favorite.objects.filter(recipe__in=self.recipes[:2]).bulk_remove(),
+            2
+        )
+        self.assertEqual(Favorite.objects.count(), 1)
+        self.assertEqual(
+            Favorite.objects.filter(recipe__in=[]).bulk_remove(), 0)
+        # Сигналы не отправляются: счетчик остается прежним.
+        self.assertEqual(self.favorites_count(self.recipes[0]), 1)